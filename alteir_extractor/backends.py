@@ -0,0 +1,167 @@
+# backends.py
+import abc
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import openai
+
+MOCK_WORDS = (
+    'the', 'ship', 'crew', 'captain', 'station', 'signal', 'we', 'must', 'leave', 'before', 'dawn', 'you',
+    'never', 'told', 'me', 'about', 'Alteir', 'engine', 'is', 'failing', 'again', 'listen', 'trust', 'them',
+)
+
+
+class GenerationBackend(abc.ABC):
+    """
+    Where the generation requests go. Both methods take the keyword parameters of the OpenAI chat
+    completions API and return objects shaped like its responses: response.choices[0].message.content,
+    or with stream=True an async iterator of chunks carrying chunk.choices[0].delta.content.
+    """
+
+    @abc.abstractmethod
+    def create(self, **parameters) -> Any:
+        """Send a request and wait for its response."""
+
+    @abc.abstractmethod
+    async def create_async(self, **parameters) -> Any:
+        """Send a request from the engine loop."""
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(GenerationBackend):
+    """The OpenAI API, or another compatible endpoint at base_url. The clients are created on first use."""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.client = None
+        self.async_client = None  # Created on the engine loop, it must only be used from it
+
+    def create(self, **parameters) -> Any:
+        if self.client is None:
+            self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self.client.chat.completions.create(**parameters)
+
+    async def create_async(self, **parameters) -> Any:
+        if self.async_client is None:
+            self.async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        return await self.async_client.chat.completions.create(**parameters)
+
+    async def close(self):
+        if self.async_client is not None:
+            await self.async_client.close()
+        if self.client is not None:
+            self.client.close()
+
+
+class MockBackendError(Exception):
+    """A failure simulated by MockBackend."""
+
+
+class MockBackend(GenerationBackend):
+    """
+    Offline stand-in for the OpenAI API, to exercise and benchmark the generation path without a network.
+    Every response is built from the JSON schema of the request's response_format, so it is valid against
+    it, with strings of words_per_string random words. A response arrives after latency seconds, give or
+    take latency_jitter. Streamed responses are then sent chunk_size characters at a time, chunk_interval
+    seconds apart. A share error_rate of the requests fail with MockBackendError, before the response
+    or part way through the stream. With a seed the whole sequence of requests is reproducible.
+    """
+
+    def __init__(self, latency: float = 1.0, latency_jitter: float = 0.0, chunk_size: int = 16,
+                 chunk_interval: float = 0.02, error_rate: float = 0.0, words_per_string: int = 12,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_interval = chunk_interval
+        self.error_rate = error_rate
+        self.words_per_string = words_per_string
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def plan(self, parameters: Dict[str, Any]):
+        """Draw everything random about one request at once, so concurrent requests stay reproducible."""
+        with self.lock:
+            self.request_count += 1
+            latency = max(0.0, self.latency + self.random.uniform(-self.latency_jitter, self.latency_jitter))
+            fails = self.random.random() < self.error_rate
+            failure_point = self.random.random()
+            content = json.dumps(self.mock_value(self.response_schema(parameters)), ensure_ascii=False)
+            return self.request_count, latency, fails, failure_point, content
+
+    def response_schema(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        response_format = parameters.get('response_format') or {}
+        return response_format.get('json_schema', {}).get('schema', {'type': 'string'})
+
+    def mock_value(self, schema: Dict[str, Any]) -> Any:
+        schema_type = schema.get('type')
+        if 'enum' in schema:
+            return self.random.choice(schema['enum'])
+        if schema_type == 'object':
+            return {name: self.mock_value(property_schema)
+                    for name, property_schema in schema.get('properties', {}).items()}
+        if schema_type == 'array':
+            count = self.random.randint(schema.get('minItems', 2), max(schema.get('minItems', 2), 3))
+            return [self.mock_value(schema.get('items', {'type': 'string'})) for _ in range(count)]
+        if schema_type == 'integer':
+            return self.random.randint(0, 100)
+        if schema_type == 'number':
+            return round(self.random.uniform(0, 100), 2)
+        if schema_type == 'boolean':
+            return self.random.random() < 0.5
+        if schema_type == 'null':
+            return None
+        sentence = ' '.join(self.random.choice(MOCK_WORDS) for _ in range(self.words_per_string))
+        return sentence[:1].upper() + sentence[1:] + '.'
+
+    def chunks(self, content: str) -> List[str]:
+        return [content[start:start + self.chunk_size] for start in range(0, len(content), self.chunk_size)]
+
+    def failure(self, request_number: int) -> MockBackendError:
+        logging.info(f"Mock backend: request {request_number} failed")
+        return MockBackendError(f"Simulated failure of request {request_number}")
+
+    def create(self, stream: bool = False, **parameters) -> Any:
+        if stream:
+            raise ValueError("MockBackend only streams asynchronous requests.")
+        request_number, latency, fails, failure_point, content = self.plan(parameters)
+        time.sleep(latency)
+        if fails:
+            raise self.failure(request_number)
+        return completion(content)
+
+    async def create_async(self, stream: bool = False, **parameters) -> Any:
+        request_number, latency, fails, failure_point, content = self.plan(parameters)
+        await asyncio.sleep(latency)
+        if not stream:
+            if fails:
+                raise self.failure(request_number)
+            return completion(content)
+        return self.stream(request_number, content, int(failure_point * len(self.chunks(content))) if fails else None)
+
+    async def stream(self, request_number: int, content: str, failing_chunk: Optional[int]):
+        for index, text in enumerate(self.chunks(content)):
+            if index == failing_chunk:
+                raise self.failure(request_number)
+            if index:
+                await asyncio.sleep(self.chunk_interval)
+            yield chunk(text)
+
+
+def completion(content: str):
+    """A response shaped like a chat completion, as much of it as the generator reads."""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=content))])
+
+
+def chunk(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
@@ -0,0 +1,94 @@
+# batch.py
+import logging
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .extractor import DialogueFlowExtractor
+from .parser import AlteirXMLParser
+from .writer import ExportWriter
+
+# Parsed model of the worker process, set once by init_worker and only read afterwards
+worker_parser = None
+
+
+def init_worker(file_path, model_state):
+    global worker_parser
+    worker_parser = AlteirXMLParser(file_path)
+    worker_parser.set_model_state(model_state)
+
+
+def extract_shard(dialogue_ids):
+    extractor = DialogueFlowExtractor(worker_parser)
+    for dialogue_id in dialogue_ids:
+        extractor.extract_dialogue_flow(dialogue_id)
+    return extractor.export_data
+
+
+def shard_ids(ids, shard_count):
+    """Split ids into contiguous shards, so concatenating the results keeps the original order."""
+    shard_size = max(1, math.ceil(len(ids) / shard_count))
+    return [ids[start:start + shard_size] for start in range(0, len(ids), shard_size)]
+
+
+def iter_shard_exports(parser, workers):
+    """
+    Yield the export of each shard of dialogue IDs, in the original dialogue order.
+    Shards are extracted by a pool of worker processes that each receive the parsed model once. Only a
+    couple of shards per worker are in flight, so finished results don't pile up in memory.
+    """
+    dialogue_ids = list(parser.dialogues)
+    # A few shards per worker keeps the pool busy when dialogues have very different sizes
+    shards = shard_ids(dialogue_ids, workers * 4)
+    logging.info(f"Extracting {len(dialogue_ids)} dialogues in {len(shards)} shards on {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(parser.file_path, parser.get_model_state())) as pool:
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.submit(extract_shard, shard))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def export_all_dialogues(parser, output_file, workers=None, export_format='compact'):
+    """
+    Extract every dialogue and write it to output_file as it is produced, in bounded memory.
+    With a single worker messages go from the traversal to the file one by one, otherwise one shard
+    at a time. Characters are listed once, in order of first appearance in the dialogues, which does not
+    depend on how the dialogues were sharded.
+    """
+    workers = workers or os.cpu_count() or 1
+    speaker_order = []
+    characters_by_id = {}
+
+    def track(messages):
+        for message in messages:
+            speaker_id = message['SpeakerId']
+            if speaker_id and speaker_id not in characters_by_id:
+                characters_by_id[speaker_id] = None
+                speaker_order.append(speaker_id)
+            yield message
+
+    with ExportWriter(output_file, export_format) as writer:
+        if workers == 1 or len(parser.dialogues) < 2:
+            logging.info(f"Exporting {len(parser.dialogues)} dialogues in-process...")
+            extractor = DialogueFlowExtractor(parser)
+            for dialogue_id in parser.dialogues:
+                for entry, messages in extractor.iter_dialogue_flow(dialogue_id):
+                    writer.write_dialogue(entry, track(messages))
+            characters = extractor.export_data['Characters']
+            characters_by_id.update((character['Id'], character) for character in characters)
+        else:
+            for export_data in iter_shard_exports(parser, workers):
+                for dialogue in export_data['Dialogues']:
+                    entry = {name: value for name, value in dialogue.items() if name != 'Messages'}
+                    writer.write_dialogue(entry, track(dialogue['Messages']))
+                for character in export_data['Characters']:
+                    characters_by_id[character['Id']] = character
+        writer.write_section('Characters', [characters_by_id[speaker_id] for speaker_id in speaker_order
+                                            if characters_by_id[speaker_id] is not None])
+        writer.write_section('Locations', [])
+    return writer.dialogue_count
@@ -0,0 +1,98 @@
+# cache.py
+import hashlib
+import logging
+import os
+import pickle
+from typing import Any, Dict, Optional
+
+# Bump whenever the models or the parser state layout change, older cache files are then ignored
+CACHE_SCHEMA_VERSION = 9
+CACHE_SUFFIX = '.parsecache'
+
+
+def file_content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Return the SHA-256 of the file content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(file_path: str) -> Dict[str, Any]:
+    """Size, modification time and content hash of a file, telling apart the versions of the file."""
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_content_hash(file_path)}
+
+
+def stamp_matches(file_path: str, stamp: Optional[Dict[str, Any]]) -> bool:
+    """Tell whether a file is still the version described by a stamp from file_stamp."""
+    if not stamp:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    if stamp.get('size') != stat.st_size:
+        return False
+    # Same size but touched: only the same content is the same version
+    return stamp.get('mtime_ns') == stat.st_mtime_ns or stamp.get('sha256') == file_content_hash(file_path)
+
+
+class ParseCache:
+    """
+    On-disk cache of the parsed model of an Articy XML export.
+    A cache file holds a small header (schema version and stamp of the XML file the model was parsed from,
+    see file_stamp) followed by the pickled parser state, so a stale or incompatible file is rejected
+    before the model itself is unpickled.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def cache_path(self, xml_path: str) -> str:
+        name = hashlib.sha1(os.path.abspath(xml_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + CACHE_SUFFIX)
+
+    def check_header(self, xml_path: str, header: Dict[str, Any]) -> bool:
+        """Tell whether a cache header still matches the XML file on disk."""
+        if header.get('schema_version') != CACHE_SCHEMA_VERSION:
+            logging.info(f"Parse cache schema mismatch for {xml_path}, full parse required")
+            return False
+        if not stamp_matches(xml_path, header):
+            logging.info(f"Parse cache is stale for {xml_path}")
+            return False
+        return True
+
+    def load(self, xml_path: str) -> Optional[Dict[str, Any]]:
+        cache_file = self.cache_path(xml_path)
+        if not os.path.exists(cache_file):
+            logging.info(f"No parse cache for {xml_path}")
+            return None
+        try:
+            with open(cache_file, 'rb') as f:
+                if not self.check_header(xml_path, pickle.load(f)):
+                    return None
+                state = pickle.load(f)
+            logging.info(f"Loaded parsed model from cache: {cache_file}")
+            return state
+        except Exception as e:
+            logging.warning(f"Could not read parse cache {cache_file}: {e}")
+            return None
+
+    def save(self, xml_path: str, state: Dict[str, Any], stamp: Dict[str, Any]):
+        """Cache the state parsed from the version of the XML file described by stamp."""
+        cache_file = self.cache_path(xml_path)
+        temp_file = cache_file + '.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            header = dict(stamp, schema_version=CACHE_SCHEMA_VERSION)
+            with open(temp_file, 'wb') as f:
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, cache_file)
+            logging.info(f"Parsed model cached to {cache_file}")
+        except Exception as e:
+            logging.warning(f"Could not write parse cache {cache_file}: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
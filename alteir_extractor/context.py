@@ -0,0 +1,204 @@
+# context.py
+import json
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # Optional, token counts are estimated from the text length without it
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4  # Rough average for English prose when no tokenizer is available
+
+
+def clean_dialogue_data(dialogue_data):
+    """Clean the dialogue data by removing unnecessary fields and keeping only English text."""
+    cleaned_data = {}
+
+    # Clean "Dialogues"
+    dialogues = dialogue_data.get('Dialogues', [])
+    cleaned_dialogues = []
+    for dialogue in dialogues:
+        cleaned_dialogue = {}
+        messages = dialogue.get('Messages', [])
+        cleaned_messages = []
+        for message in messages:
+            # Keep only 'Text' and 'SpeakerName'
+            cleaned_message = {
+                'Text': message.get('Text', ''),
+                'SpeakerName': message.get('SpeakerName', 'Unnamed')
+            }
+            cleaned_messages.append(cleaned_message)
+        cleaned_dialogue['Messages'] = cleaned_messages
+        cleaned_dialogues.append(cleaned_dialogue)
+    cleaned_data['Dialogues'] = cleaned_dialogues
+
+    # Clean "Characters"
+    characters = dialogue_data.get('Characters', [])
+    cleaned_characters = []
+    for character in characters:
+        cleaned_character = {}
+        cleaned_character['DisplayName'] = character.get('DisplayName', '')
+        cleaned_character['Text'] = character.get('Text', '')
+        # Process Features
+        features = character.get('Features', [])
+        cleaned_features = []
+        for feature in features:
+            properties = feature.get('Properties', {})
+            cleaned_properties = {}
+            for key, value in properties.items():
+                # If value is a list with both French and English, keep only the English text
+                if isinstance(value, list):
+                    if len(value) > 1:
+                        # Assume the second item is English
+                        cleaned_value = value[1]
+                    else:
+                        cleaned_value = value[0]
+                    cleaned_properties[key] = cleaned_value
+                else:
+                    cleaned_properties[key] = value
+            cleaned_features.append({'Properties': cleaned_properties})
+        cleaned_character['Features'] = cleaned_features
+        cleaned_characters.append(cleaned_character)
+    cleaned_data['Characters'] = cleaned_characters
+
+    # Include "Locations" if necessary
+    if 'Locations' in dialogue_data:
+        cleaned_data['Locations'] = dialogue_data['Locations']
+
+    return cleaned_data
+
+
+@dataclass
+class PromptContext:
+    """
+    An extraction ready to be sent to the generator: cleaned once when the extraction is done, then
+    shared by the character dropdown and every generation until the next extraction or reload.
+    """
+    cleaned_data: Dict[str, Any]
+    character_names: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_export(cls, export_data: Dict[str, Any]) -> 'PromptContext':
+        character_names = [character.get('DisplayName', 'Unnamed') for character in export_data.get('Characters', [])]
+        return cls(clean_dialogue_data(export_data), character_names)
+
+    @classmethod
+    def load(cls, export_file: str) -> 'PromptContext':
+        """Build the context from an export written earlier."""
+        with open(export_file, 'r', encoding='utf-8') as f:
+            return cls.from_export(json.load(f))
+
+
+def compact_json(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def canonical_json(value) -> str:
+    """Compact JSON with sorted keys, the same bytes for the same value whatever the order it was built in."""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken when it is installed, otherwise estimates them from the text length."""
+
+    def __init__(self, encoding_name: str = 'o200k_base'):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logging.warning(f"Tokenizer {encoding_name} unavailable, token counts are estimated: {e}")
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class ContextPacker:
+    """
+    Fits the characters and dialogues of a generation prompt into a token budget.
+    The selected character is always sent in full. The other characters get up to character_share of
+    the budget, in full while they fit, then with their features dropped. The dialogue messages are
+    flattened in order and kept from the most recent backwards while they fit. The older ones are
+    summarized, one shortened line each within summary_share of the budget, then only counted.
+    Everything is serialized as compact JSON. The characters are sorted by name and serialized canonically,
+    so the same characters give the same text whichever one is selected while they all fit.
+    """
+
+    def __init__(self, token_budget: int = 8000, character_share: float = 0.3, summary_share: float = 0.1,
+                 summary_words: int = 12, counter: Optional[TokenCounter] = None):
+        self.token_budget = token_budget
+        self.character_share = character_share
+        self.summary_share = summary_share
+        self.summary_words = summary_words
+        self.counter = counter or TokenCounter()
+
+    def pack(self, selected_character: str, cleaned_data: Dict[str, Any]) -> Tuple[str, str]:
+        """Return the serialized characters and dialogues, together within the token budget when possible."""
+        characters_text, character_tokens = self.pack_characters(selected_character, cleaned_data.get('Characters', []))
+        dialogue_budget = max(0, self.token_budget - character_tokens)
+        dialogues_text = self.pack_dialogues(cleaned_data.get('Dialogues', []), dialogue_budget)
+        return characters_text, dialogues_text
+
+    def pack_characters(self, selected_character: str, characters: List[Dict[str, Any]]) -> Tuple[str, int]:
+        selected = [character for character in characters if character.get('DisplayName') == selected_character]
+        others = [character for character in characters if character.get('DisplayName') != selected_character]
+        packed = list(selected)
+        tokens = sum(self.counter.count(canonical_json(character)) for character in selected)
+        others_budget = self.token_budget * self.character_share
+        for character in others:
+            for variant in (character, {'DisplayName': character.get('DisplayName', ''), 'Text': character.get('Text', '')},
+                            {'DisplayName': character.get('DisplayName', '')}):
+                variant_tokens = self.counter.count(canonical_json(variant))
+                if variant_tokens <= others_budget:
+                    packed.append(variant)
+                    others_budget -= variant_tokens
+                    tokens += variant_tokens
+                    break
+        # Sorted rather than selected first, so the text only depends on which variant of each character fit
+        packed.sort(key=lambda character: (character.get('DisplayName') or '', canonical_json(character)))
+        return canonical_json(packed), tokens
+
+    def pack_dialogues(self, dialogues: List[Dict[str, Any]], budget: int) -> str:
+        messages = [message for dialogue in dialogues for message in dialogue.get('Messages', [])]
+        recent_budget = budget * (1 - self.summary_share)
+        kept = 0
+        used = 0
+        for message in reversed(messages):
+            message_tokens = self.counter.count(compact_json(message)) + 1
+            if used + message_tokens > recent_budget:
+                break
+            used += message_tokens
+            kept += 1
+        older, recent = messages[:len(messages) - kept], messages[len(messages) - kept:]
+        if not older:
+            # Everything fits: keep the dialogues as they are
+            return compact_json([{'Messages': dialogue.get('Messages', [])} for dialogue in dialogues])
+        packed = {
+            'EarlierSummary': self.summarize(older, budget - used),
+            'RecentMessages': recent
+        }
+        logging.info(f"Context packed: {len(recent)} recent messages kept, {len(older)} earlier ones summarized")
+        return compact_json(packed)
+
+    def summarize(self, messages: List[Dict[str, Any]], budget: float) -> List[str]:
+        """One shortened line per message from the most recent backwards, then a count of the rest."""
+        lines = []
+        for message in reversed(messages):
+            words = message.get('Text', '').split()
+            text = ' '.join(words[:self.summary_words]) + ('...' if len(words) > self.summary_words else '')
+            line = f"{message.get('SpeakerName', 'Unnamed')}: {text}"
+            line_tokens = self.counter.count(compact_json(line)) + 1
+            if line_tokens > budget:
+                break
+            budget -= line_tokens
+            lines.append(line)
+        omitted = len(messages) - len(lines)
+        lines.reverse()
+        if omitted:
+            lines.insert(0, f"({omitted} earlier messages omitted)")
+        return lines
@@ -0,0 +1,104 @@
+# engine.py
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Coroutine, Optional, Set
+
+from .backends import GenerationBackend
+
+
+class GenerationEngine:
+    """
+    Runs LLM requests on an asyncio event loop owned by a background thread, so many requests can be
+    in flight at once while the GUI thread stays free.
+    All requests go through one backend, the OpenAI API or an offline MockBackend, whose async client lives
+    on the loop. At most max_concurrency of them run at the same time, the others wait their turn. Each
+    one is given up after timeout seconds. submit() can be called from any thread and returns a
+    concurrent.futures.Future, cancelling it (or calling cancel_all) cancels the request on the loop.
+    requests_per_minute, when set, also spaces out the start of the requests so a batch stays under the
+    provider's rate limit.
+    """
+
+    def __init__(self, backend: GenerationBackend, max_concurrency: int = 4, timeout: Optional[float] = 120.0,
+                 requests_per_minute: Optional[float] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.start_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_start = 0.0  # Loop time before which no other request may start
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="GenerationEngine", daemon=True)
+        self.thread.start()
+        self.backend = backend
+        # Created on the loop, it must only be used from it
+        self.semaphore = self.call(self.create_semaphore())
+        self.pending: Set[concurrent.futures.Future] = set()
+        self.lock = threading.Lock()
+
+    async def create_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def call(self, coroutine: Coroutine) -> Any:
+        """Run a coroutine on the loop and wait for its result, from any thread but the loop's."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def wait_for_start_slot(self):
+        """Wait until the rate limit lets another request go out, awaited right before calling the API."""
+        if not self.start_interval:
+            return
+        now = self.loop.time()
+        start = max(now, self.next_start)
+        self.next_start = start + self.start_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def run_limited(self, coroutine: Coroutine, timeout: Optional[float]):
+        async with self.semaphore:
+            # The timeout only counts once the request is allowed to run
+            return await asyncio.wait_for(coroutine, timeout)
+
+    def submit(self, coroutine: Coroutine, timeout: Optional[float] = None) -> concurrent.futures.Future:
+        """
+        Schedule a request coroutine, typically DialogueGenerator.generate_next_line_async, and return its
+        future. A request that times out fails with asyncio.TimeoutError.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.run_limited(coroutine, timeout if timeout is not None else self.timeout), self.loop
+        )
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.forget)
+        return future
+
+    def forget(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def in_flight(self) -> int:
+        """Requests submitted and not finished yet, running or waiting for a slot."""
+        with self.lock:
+            return len(self.pending)
+
+    def cancel_all(self) -> int:
+        """Cancel every request not finished yet, returns how many were cancelled."""
+        with self.lock:
+            pending = list(self.pending)
+        cancelled = sum(1 for future in pending if future.cancel())
+        if cancelled:
+            logging.info(f"Cancelled {cancelled} generation request(s)")
+        return cancelled
+
+    def close(self):
+        """Cancel the pending requests, close the backend and stop the loop thread."""
+        if not self.loop.is_running():
+            return
+        self.cancel_all()
+        try:
+            self.call(self.backend.close())
+        except Exception as e:
+            logging.warning(f"Error closing the generation backend: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
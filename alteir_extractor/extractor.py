@@ -1,16 +1,82 @@
 # extractor.py
 import logging
-import json
-from dataclasses import asdict  # Import asdict to convert dataclass to dictionary
+import threading
+from collections import OrderedDict
+
+from .writer import write_export
+
+class FlowCache:
+    """
+    LRU cache of traversed flows keyed by (starting fragment ID, direction), shared between extractors.
+    Each flow is kept with the nodes its traversal looked at: its fragments and their neighbours in the
+    direction of the walk. A full parse, or another parser, empties the cache. After a reload only the
+    flows going through a node the reload changed are dropped, see AlteirXMLParser.changes_since.
+    The cached message lists are shared, callers must not modify the messages.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (fragment ID, direction) -> (flow, IDs of the nodes it depends on)
+        self.parser = None
+        self.revision = None
+        self.lock = threading.Lock()
+
+    def sync(self, parser):
+        if parser is self.parser and parser.revision == self.revision:
+            return
+        changed = parser.changes_since(self.revision) if parser is self.parser else None
+        if changed is None:
+            self.entries.clear()
+        elif changed:
+            stale = [key for key, (_, node_ids) in self.entries.items() if not node_ids.isdisjoint(changed)]
+            for key in stale:
+                del self.entries[key]
+            logging.debug(f"Flow cache: {len(stale)} flows dropped, {len(self.entries)} kept")
+        self.parser = parser
+        self.revision = parser.revision
+
+    def get(self, parser, fragment_id, direction):
+        with self.lock:
+            self.sync(parser)
+            entry = self.entries.get((fragment_id, direction))
+            if entry is None:
+                return None
+            self.entries.move_to_end((fragment_id, direction))
+            return entry[0]
+
+    def put(self, parser, fragment_id, direction, flow):
+        with self.lock:
+            self.sync(parser)
+            self.entries[(fragment_id, direction)] = (flow, self.flow_nodes(parser, fragment_id, direction, flow))
+            self.entries.move_to_end((fragment_id, direction))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    @staticmethod
+    def flow_nodes(parser, fragment_id, direction, flow):
+        """IDs of every node the traversal of the flow looked at, a change to any of them may change the flow."""
+        graph = parser.get_connection_graph()
+        neighbours = graph.targets if direction == 'forward' else graph.sources
+        node_ids = {fragment_id}
+        for message in flow:
+            node_ids.add(message['FragmentId'])
+            node_ids.update(neighbours(message['FragmentId']))
+        return frozenset(node_ids)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
 
 class DialogueFlowExtractor:
-    def __init__(self, parser):
+    def __init__(self, parser, flow_cache: FlowCache = None):
         self.parser = parser
+        self.flow_cache = flow_cache
         self.export_data = {
             'Dialogues': [],
             'Characters': [],
             'Locations': []
         }
+        self.exported_character_ids = set()
 
     def extract_dialogue_flow(self, dialogue_id: str):
         if dialogue_id not in self.parser.dialogues:
@@ -22,7 +88,7 @@ class DialogueFlowExtractor:
         involved_character_ids = set()
 
         for fragment_id in starting_fragments:
-            flow = self.traverse_fragments_forward(fragment_id)
+            flow = self.get_flow(fragment_id, 'forward')
             dialogue_entry = {
                 'DialogueId': dialogue_id,
                 'DisplayName': self.parser.dialogues[dialogue_id].DisplayName,
@@ -34,23 +100,43 @@ class DialogueFlowExtractor:
                 if message['SpeakerId']:
                     involved_character_ids.add(message['SpeakerId'])
 
-        # Convert Entity instances to dictionaries before adding to export_data
-        for char_id in involved_character_ids:
-            if char_id in self.parser.entities:
-                entity = self.parser.entities[char_id]
-                entity_dict = asdict(entity)
-                if entity_dict not in self.export_data['Characters']:
-                    self.export_data['Characters'].append(entity_dict)
-                    logging.debug(f"Character added: ID={char_id}, Name={entity.DisplayName}")
-            else:
-                logging.warning(f"Entity ID={char_id} not found.")
+        self.add_characters(involved_character_ids)
+
+    def iter_dialogue_flow(self, dialogue_id: str):
+        """
+        Streaming variant of extract_dialogue_flow for exports written with an ExportWriter.
+        Yields (entry, messages) for each starting fragment, messages being a generator over the
+        traversal to consume before asking for the next entry. Messages are not kept in export_data,
+        only the characters involved are added to it as they are met.
+        """
+        if dialogue_id not in self.parser.dialogues:
+            logging.error(f"Dialogue ID={dialogue_id} does not exist.")
+            return
+        dialogue = self.parser.dialogues[dialogue_id]
+        if not dialogue.StartingFragments:
+            logging.warning(f"No starting fragments found for Dialogue ID={dialogue_id}.")
+        for fragment_id in dialogue.StartingFragments:
+            entry = {
+                'DialogueId': dialogue_id,
+                'DisplayName': dialogue.DisplayName
+            }
+            yield entry, self.track_speakers(self.iter_fragments_forward(fragment_id))
+
+    def track_speakers(self, messages):
+        seen_speaker_ids = set()
+        for message in messages:
+            speaker_id = message['SpeakerId']
+            if speaker_id and speaker_id not in seen_speaker_ids:
+                seen_speaker_ids.add(speaker_id)
+                self.add_characters((speaker_id,))
+            yield message
 
     def extract_fragment_flow(self, fragment_id: str):
         if fragment_id not in self.parser.fragments:
             logging.error(f"Fragment ID={fragment_id} does not exist.")
             return
         involved_character_ids = set()
-        flow = self.traverse_fragments_backward(fragment_id)
+        flow = self.get_flow(fragment_id, 'backward')
         fragment_entry = {
             'FragmentId': fragment_id,
             'Messages': flow
@@ -61,66 +147,118 @@ class DialogueFlowExtractor:
             if message['SpeakerId']:
                 involved_character_ids.add(message['SpeakerId'])
 
-        # Convert Entity instances to dictionaries before adding to export_data
-        for char_id in involved_character_ids:
+        self.add_characters(involved_character_ids)
+
+    def add_characters(self, character_ids):
+        # Characters are tracked by ID, their export dicts are built once per entity by the parser
+        for char_id in character_ids:
+            if char_id in self.exported_character_ids:
+                continue
             if char_id in self.parser.entities:
-                entity = self.parser.entities[char_id]
-                entity_dict = asdict(entity)
-                if entity_dict not in self.export_data['Characters']:
-                    self.export_data['Characters'].append(entity_dict)
-                    logging.debug(f"Character added: ID={char_id}, Name={entity.DisplayName}")
+                self.export_data['Characters'].append(self.parser.get_entity_dict(char_id))
+                self.exported_character_ids.add(char_id)
+                logging.debug(f"Character added: ID={char_id}, Name={self.parser.entities[char_id].DisplayName}")
             else:
                 logging.warning(f"Entity ID={char_id} not found.")
 
+    def get_flow(self, fragment_id, direction):
+        """Return the flow starting at fragment_id, reusing the flow cache when there is one."""
+        if self.flow_cache is not None:
+            flow = self.flow_cache.get(self.parser, fragment_id, direction)
+            if flow is not None:
+                logging.debug(f"Flow cache hit for fragment ID={fragment_id} ({direction})")
+                return list(flow)
+        if direction == 'forward':
+            flow = self.traverse_fragments_forward(fragment_id)
+        else:
+            flow = self.traverse_fragments_backward(fragment_id)
+        if self.flow_cache is not None:
+            self.flow_cache.put(self.parser, fragment_id, direction, flow)
+            return list(flow)
+        return flow
+
     def traverse_fragments_forward(self, fragment_id, visited=None):
+        return list(self.iter_fragments_forward(fragment_id, visited))
+
+    def traverse_fragments_backward(self, fragment_id, visited=None):
+        return list(self.iter_fragments_backward(fragment_id, visited))
+
+    def iter_fragments_forward(self, fragment_id, visited=None):
+        """
+        Yield the messages reachable from fragment_id, depth-first, each fragment before its targets.
+        Uses an explicit stack of connection graph indices so long chains don't hit the recursion limit.
+        Targets are pushed in reverse so they are popped in connection order, as the recursive traversal
+        visited them.
+        """
         if visited is None:
             visited = set()
-        if fragment_id in visited:
-            logging.warning(f"Loop detected at fragment ID={fragment_id}, stopping traversal.")
-            return []
-        visited.add(fragment_id)
-        fragment = self.parser.fragments.get(fragment_id)
-        if not fragment:
+        graph = self.parser.get_connection_graph()
+        start = graph.index_of.get(fragment_id)
+        if start is None:
             logging.warning(f"Fragment ID={fragment_id} not found.")
-            return []
-        flow = [{
-            'FragmentId': fragment_id,
-            'Text': fragment.Text,
-            'SpeakerId': fragment.SpeakerId,
-            'SpeakerName': fragment.SpeakerName
-        }]
-        for target_id in self.parser.source_to_targets.get(fragment_id, []):
-            flow.extend(self.traverse_fragments_forward(target_id, visited))
-        return flow
+            return
+        stack = [start]
+        while stack:
+            index = stack.pop()
+            current_id = graph.ids[index]
+            if current_id in visited:
+                logging.warning(f"Loop detected at fragment ID={current_id}, stopping traversal.")
+                continue
+            visited.add(current_id)
+            fragment = self.parser.fragments.get(current_id)
+            if not fragment:
+                logging.warning(f"Fragment ID={current_id} not found.")
+                continue
+            yield self.fragment_message(current_id, fragment)
+            stack.extend(reversed(graph.target_indices(index)))
 
-    def traverse_fragments_backward(self, fragment_id, visited=None):
+    def iter_fragments_backward(self, fragment_id, visited=None):
+        """
+        Yield the messages leading to fragment_id, depth-first, each fragment after its sources.
+        Every stack frame keeps an iterator over the source indices still to visit, the fragment itself
+        is yielded once they are exhausted.
+        """
         if visited is None:
             visited = set()
         if fragment_id in visited:
             logging.warning(f"Loop detected at fragment ID={fragment_id}, stopping traversal.")
-            return []
+            return
         visited.add(fragment_id)
-        flow = []
-        for conn in self.parser.connections:
-            if conn.Target == fragment_id:
-                source_id = conn.Source
-                if source_id in self.parser.fragments:
-                    flow_part = self.traverse_fragments_backward(source_id, visited)
-                    flow.extend(flow_part)
-        fragment = self.parser.fragments.get(fragment_id)
-        if fragment:
-            flow.append({
-                'FragmentId': fragment_id,
-                'Text': fragment.Text,
-                'SpeakerId': fragment.SpeakerId,
-                'SpeakerName': fragment.SpeakerName
-            })
-        return flow
+        graph = self.parser.get_connection_graph()
+        start = graph.index_of.get(fragment_id)
+        if start is None:
+            return
+        stack = [(start, iter(graph.source_indices(start)))]
+        while stack:
+            index, sources = stack[-1]
+            for source in sources:
+                if not graph.is_fragment(source):
+                    continue
+                source_id = graph.ids[source]
+                if source_id in visited:
+                    logging.warning(f"Loop detected at fragment ID={source_id}, stopping traversal.")
+                    continue
+                visited.add(source_id)
+                stack.append((source, iter(graph.source_indices(source))))
+                break
+            else:
+                stack.pop()
+                current_id = graph.ids[index]
+                fragment = self.parser.fragments.get(current_id)
+                if fragment:
+                    yield self.fragment_message(current_id, fragment)
+
+    @staticmethod
+    def fragment_message(fragment_id, fragment):
+        return {
+            'FragmentId': fragment_id,
+            'Text': fragment.Text,
+            'SpeakerId': fragment.SpeakerId,
+            'SpeakerName': fragment.SpeakerName
+        }
 
-def save_to_json(data, output_file):
+def save_to_json(data, output_file, export_format='pretty'):
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        logging.info(f"Data successfully exported to {output_file}")
+        write_export(data, output_file, export_format)
     except Exception as e:
         logging.error(f"Error saving JSON file: {e}")
@@ -2,53 +2,211 @@
 
 import os
 import json
-import openai
+import time
+import hashlib
+import tempfile
+import threading
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
+
+from .partial_json import parse_partial_json
+from .context import ContextPacker, PromptContext, clean_dialogue_data
+from .templates import InstructionTemplates
+from .backends import GenerationBackend, OpenAIBackend
+
+# The instruction files live at the root of the project, next to main.py
+DEFAULT_INSTRUCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class GenerationCache:
+    """
+    On-disk LRU cache of generation outputs, keyed by a fingerprint of everything the output depends on.
+    Each entry is a JSON file in cache_dir, its modification time is refreshed on every hit and the least
+    recently used entries are removed once there are more than max_entries.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 200):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(request_parameters: Dict[str, Any]) -> str:
+        """
+        Hash of the request as it is sent: model, final messages, schema and sampling settings. Any change
+        to the prompt, such as the instructions, the packing budget or the message layout, gives a new key.
+        """
+        canonical = json.dumps(request_parameters, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry_file = self.entry_path(key)
+        with self.lock:
+            try:
+                with open(entry_file, 'r', encoding='utf-8') as f:
+                    output = json.load(f)
+                os.utime(entry_file)  # Most recently used
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                logging.warning(f"Could not read generation cache entry {entry_file}: {e}")
+                return None
+        logging.info(f"Generation cache hit: {key}")
+        return output
+
+    def put(self, key: str, output: Dict[str, Any]):
+        entry_file = self.entry_path(key)
+        with self.lock:
+            temp_file = None
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(output, f, ensure_ascii=False)
+                os.replace(temp_file, entry_file)
+                self.evict()
+            except Exception as e:
+                logging.warning(f"Could not write generation cache entry {entry_file}: {e}")
+                if temp_file and os.path.exists(temp_file):
+                    os.remove(temp_file)
+
+    def evict(self):
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries[:len(entries) - self.max_entries]:
+            os.remove(entry.path)
+            logging.debug(f"Generation cache entry evicted: {entry.name}")
+
+    def clear(self):
+        with self.lock:
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith('.json'):
+                        os.remove(entry.path)
 
 class DialogueGenerator:
-    def __init__(self, api_key: str = None):
-        # Set up OpenAI API key
+    def __init__(self, api_key: str = None, engine=None, stream_update_interval: float = 0.1,
+                 cache: GenerationCache = None, temperature: float = 0.8, context_token_budget: int = 8000,
+                 templates: InstructionTemplates = None, backend: GenerationBackend = None):
+        # GenerationEngine whose backend serves generate_next_line_async
+        self.engine = engine
+        # Where the requests go, the engine's backend by default, the OpenAI API when there is no engine
+        self.backend = backend or (engine.backend if engine is not None else None)
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
-            raise ValueError("OpenAI API key must be provided or set as an environment variable 'OPENAI_API_KEY'")
-        openai.api_key = self.api_key
+        if self.backend is None:
+            # Set up OpenAI API key
+            if not self.api_key:
+                raise ValueError("OpenAI API key must be provided or set as an environment variable 'OPENAI_API_KEY'")
+            self.backend = OpenAIBackend(self.api_key)
+        self.stream_update_interval = stream_update_interval
+        # Outputs are reused for identical requests unless use_cache is False, as for a reroll
+        self.cache = cache
+        self.temperature = temperature
+        # Fits the characters and dialogues sent with each request into a token budget
+        self.context_packer = ContextPacker(context_token_budget)
+        # Share one registry between generators so each template is only read again when its file changes
+        self.templates = templates or InstructionTemplates(DEFAULT_INSTRUCTION_DIR)
 
     def generate_next_line(self, dialogue_data: Dict[str, Any], selected_character: str, custom_instruction: str,
-                           generation_option: str, selected_model: str = "gpt-4o", language: str = 'en') -> \
-            Dict[str, Any]:
+                           generation_option: str, selected_model: str = "gpt-4o", language: str = 'en',
+                           use_cache: bool = True) -> Dict[str, Any]:
+        messages, output_schema, cache_key = self.prepare_request(
+            dialogue_data, selected_character, custom_instruction, generation_option, selected_model
+        )
+        cached_output = self.get_cached_output(cache_key, use_cache)
+        if cached_output is not None:
+            return cached_output
+
+        # Send the request to the OpenAI Chat API with structured JSON output
+        response = None
+        try:
+            response = self.send_openai_request(selected_model, messages, output_schema)
+            return self.cache_output(cache_key, self.parse_response(response))
+
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e}")
+            logging.error(f"Response: {response}")
+            raise e
+
+    async def generate_next_line_async(self, dialogue_data: Dict[str, Any], selected_character: str,
+                                       custom_instruction: str, generation_option: str,
+                                       selected_model: str = "gpt-4o", language: str = 'en',
+                                       on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+                                       use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Same as generate_next_line, sent through the engine's async client. Submit it with engine.submit.
+        With on_partial the response is streamed: on_partial is called on the engine thread with the
+        output parsed so far, at most every stream_update_interval seconds, then the full output is returned.
+        """
+        messages, output_schema, cache_key = self.prepare_request(
+            dialogue_data, selected_character, custom_instruction, generation_option, selected_model
+        )
+        cached_output = self.get_cached_output(cache_key, use_cache)
+        if cached_output is not None:
+            return cached_output
+
+        response = None
+        try:
+            if on_partial is not None:
+                response = await self.stream_openai_request(selected_model, messages, output_schema, on_partial)
+                return self.cache_output(cache_key, json.loads(response))
+            response = await self.send_openai_request_async(selected_model, messages, output_schema)
+            return self.cache_output(cache_key, self.parse_response(response))
+
+        except Exception as e:
+            logging.error(f"Error during OpenAI API call: {e!r}")
+            logging.error(f"Response: {response}")
+            raise e
+
+    def prepare_request(self, dialogue_data: Dict[str, Any], selected_character: str, custom_instruction: str,
+                        generation_option: str, selected_model: str):
+        """Build the messages to send, the expected output schema and the generation cache key."""
         # Load instruction content
-        instruction_content = self.get_instruction_content(generation_option)
+        instruction_template = self.get_instruction_template(generation_option)
+        instruction_content = instruction_template.render(character=selected_character)
 
-        # Clean and simplify dialogue and character data
-        cleaned_data = self.clean_dialogue_data(dialogue_data)
+        # Clean and simplify dialogue and character data, a PromptContext was cleaned once when it was built
+        if isinstance(dialogue_data, PromptContext):
+            cleaned_data = dialogue_data.cleaned_data
+        else:
+            cleaned_data = self.clean_dialogue_data(dialogue_data)
 
-        # Construct system and user messages
+        # Construct system and user messages, from the most stable to the most volatile
         system_message = self.construct_system_message(instruction_content)
-        user_message_content = self.construct_user_message_content(selected_character, cleaned_data, custom_instruction)
+        context_message_content = self.construct_context_message_content(selected_character, cleaned_data)
+        request_message_content = self.construct_request_message_content(selected_character, custom_instruction)
 
         # Define the expected structured output format as JSON Schema
         output_schema = self.define_output_schema()
 
         # Construct messages for the API
-        messages = self.construct_messages(system_message, user_message_content)
+        messages = self.construct_messages(system_message, context_message_content, request_message_content)
 
         # Print the messages being sent to the API
         self.print_api_message(messages)
 
-        # Send the request to the OpenAI Chat API with structured JSON output
-        try:
-            response = self.send_openai_request(selected_model, messages, output_schema)
+        cache_key = GenerationCache.fingerprint(self.request_parameters(selected_model, messages, output_schema))
+        return messages, output_schema, cache_key
 
-            # Extract the assistant's message
-            assistant_message = response.choices[0].message.content
-            generated_response = json.loads(assistant_message)
-            return generated_response
+    def get_cached_output(self, cache_key: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+        if self.cache is None or not use_cache:
+            return None
+        return self.cache.get(cache_key)
 
-        except Exception as e:
-            logging.error(f"Error during OpenAI API call: {e}")
-            logging.error(f"Response: {response}")
-            raise e
+    def cache_output(self, cache_key: str, output: Dict[str, Any]) -> Dict[str, Any]:
+        # A reroll replaces the entry, so asking again for the same request shows the latest output
+        if self.cache is not None:
+            self.cache.put(cache_key, output)
+        return output
+
+    def parse_response(self, response: Any) -> Dict[str, Any]:
+        # Extract the assistant's message
+        assistant_message = response.choices[0].message.content
+        return json.loads(assistant_message)
 
     def print_api_message(self, messages: List[Dict[str, Any]]) -> None:
         print("\n--- API Request Messages ---")
@@ -59,21 +217,12 @@ class DialogueGenerator:
             print(f"Content:\n{content}\n")
         print("--- End of Messages ---\n")
 
-    def get_instruction_content(self, generation_option: str) -> str:
-        # Choose the instruction file based on the generation option
-        if generation_option == 'alternatives':
-            instruction_file = 'instruction_alternatives.txt'
-        else:
-            instruction_file = 'instruction.txt'
-
-        # Load the corresponding instruction file
-        if not os.path.exists(instruction_file):
-            raise ValueError(f"Instruction file '{instruction_file}' not found.")
+    def get_instruction_template(self, generation_option: str):
+        # Options without a template of their own use the continuation instructions
+        return self.templates.get(generation_option if generation_option in self.templates else 'continuation')
 
-        with open(instruction_file, 'r', encoding='utf-8') as file:
-            instruction_content = file.read().strip()
-
-        return instruction_content
+    def get_instruction_content(self, generation_option: str) -> str:
+        return self.get_instruction_template(generation_option).text
 
     def construct_system_message(self, instruction_content: str) -> Dict[str, str]:
         return {
@@ -81,24 +230,26 @@ class DialogueGenerator:
             "content": instruction_content
         }
 
-    def construct_user_message_content(self, selected_character: str, cleaned_data: Dict[str, Any],
-                                       custom_instruction: str) -> str:
-        return f"""
-    Here are the details of the selected character:
-
-    Character name: {selected_character}
-
-    Here are the details of all characters involved:
-
-    {json.dumps(cleaned_data['Characters'], indent=2, ensure_ascii=False)}
-
-    Here's the context of the dialogues:
-
-    {json.dumps(cleaned_data['Dialogues'], indent=2, ensure_ascii=False)}
+    def construct_context_message_content(self, selected_character: str, cleaned_data: Dict[str, Any]) -> str:
+        """
+        The characters and dialogues of the extraction. Nothing specific to one request goes in it, so
+        with the system message it forms a prefix that stays byte-identical across rerolls and custom
+        instructions, and that the provider can cache.
+        """
+        characters_text, dialogues_text = self.context_packer.pack(selected_character, cleaned_data)
+        return (
+            "Here are the details of all characters involved:\n\n"
+            f"{characters_text}\n\n"
+            "Here's the context of the dialogues:\n\n"
+            f"{dialogues_text}"
+        )
 
-    Based on this context, generate the next dialogue sequence for character {selected_character}.
-    {custom_instruction}
-    """
+    def construct_request_message_content(self, selected_character: str, custom_instruction: str) -> str:
+        return (
+            f"Character name: {selected_character}\n\n"
+            f"Based on this context, generate the next dialogue sequence for character {selected_character}.\n"
+            f"{custom_instruction}"
+        ).strip()
 
     def define_output_schema(self) -> Dict[str, Any]:
         return {
@@ -145,19 +296,22 @@ class DialogueGenerator:
             "additionalProperties": False
         }
 
-    def construct_messages(self, system_message: Dict[str, str], user_message_content: str) -> List[Dict[str, Any]]:
+    def construct_messages(self, system_message: Dict[str, str], context_message_content: str,
+                           request_message_content: str) -> List[Dict[str, Any]]:
+        # The request comes last so everything before it can be reused by the provider's prompt cache
         return [
             system_message,
-            {"role": "user", "content": user_message_content}
+            {"role": "user", "content": context_message_content},
+            {"role": "user", "content": request_message_content}
         ]
 
-    def send_openai_request(self, selected_model: str, messages: List[Dict[str, Any]],
-                            output_schema: Dict[str, Any]) -> Any:
-        return openai.chat.completions.create(
+    def request_parameters(self, selected_model: str, messages: List[Dict[str, Any]],
+                           output_schema: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
             model=selected_model,
             messages=messages,
             max_tokens=10000,
-            temperature=0.8,
+            temperature=self.temperature,
             response_format={  # Request structured output in JSON schema
                 "type": "json_schema",
                 "json_schema": {
@@ -168,59 +322,51 @@ class DialogueGenerator:
             }
         )
 
+    def send_openai_request(self, selected_model: str, messages: List[Dict[str, Any]],
+                            output_schema: Dict[str, Any]) -> Any:
+        return self.backend.create(**self.request_parameters(selected_model, messages, output_schema))
+
+    async def send_openai_request_async(self, selected_model: str, messages: List[Dict[str, Any]],
+                                        output_schema: Dict[str, Any]) -> Any:
+        if self.engine is None:
+            raise ValueError("Asynchronous requests need a GenerationEngine.")
+        await self.engine.wait_for_start_slot()
+        return await self.backend.create_async(
+            **self.request_parameters(selected_model, messages, output_schema)
+        )
+
+    async def stream_openai_request(self, selected_model: str, messages: List[Dict[str, Any]],
+                                    output_schema: Dict[str, Any],
+                                    on_partial: Callable[[Dict[str, Any]], None]) -> str:
+        """Stream the response, reporting the partially parsed output as it arrives, and return its full text."""
+        if self.engine is None:
+            raise ValueError("Asynchronous requests need a GenerationEngine.")
+        await self.engine.wait_for_start_slot()
+        stream = await self.backend.create_async(
+            stream=True, **self.request_parameters(selected_model, messages, output_schema)
+        )
+        content = []
+        last_update = 0.0
+        reported = None
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            content.append(chunk.choices[0].delta.content)
+            now = time.monotonic()
+            if now - last_update >= self.stream_update_interval:
+                last_update = now
+                # The whole text is parsed again, the interval keeps that cost bounded
+                try:
+                    partial_output = parse_partial_json(''.join(content))
+                except ValueError as e:
+                    # Only the preview is lost, the full text is checked once the stream is over
+                    logging.debug(f"Partial output not shown: {e}")
+                    continue
+                if partial_output and partial_output != reported:
+                    reported = partial_output
+                    on_partial(partial_output)
+        return ''.join(content)
+
     def clean_dialogue_data(self, dialogue_data):
         """Clean the dialogue data by removing unnecessary fields and keeping only English text."""
-        cleaned_data = {}
-
-        # Clean "Dialogues"
-        dialogues = dialogue_data.get('Dialogues', [])
-        cleaned_dialogues = []
-        for dialogue in dialogues:
-            cleaned_dialogue = {}
-            messages = dialogue.get('Messages', [])
-            cleaned_messages = []
-            for message in messages:
-                # Keep only 'Text' and 'SpeakerName'
-                cleaned_message = {
-                    'Text': message.get('Text', ''),
-                    'SpeakerName': message.get('SpeakerName', 'Unnamed')
-                }
-                cleaned_messages.append(cleaned_message)
-            cleaned_dialogue['Messages'] = cleaned_messages
-            cleaned_dialogues.append(cleaned_dialogue)
-        cleaned_data['Dialogues'] = cleaned_dialogues
-
-        # Clean "Characters"
-        characters = dialogue_data.get('Characters', [])
-        cleaned_characters = []
-        for character in characters:
-            cleaned_character = {}
-            cleaned_character['DisplayName'] = character.get('DisplayName', '')
-            cleaned_character['Text'] = character.get('Text', '')
-            # Process Features
-            features = character.get('Features', [])
-            cleaned_features = []
-            for feature in features:
-                properties = feature.get('Properties', {})
-                cleaned_properties = {}
-                for key, value in properties.items():
-                    # If value is a list with both French and English, keep only the English text
-                    if isinstance(value, list):
-                        if len(value) > 1:
-                            # Assume the second item is English
-                            cleaned_value = value[1]
-                        else:
-                            cleaned_value = value[0]
-                        cleaned_properties[key] = cleaned_value
-                    else:
-                        cleaned_properties[key] = value
-                cleaned_features.append({'Properties': cleaned_properties})
-            cleaned_character['Features'] = cleaned_features
-            cleaned_characters.append(cleaned_character)
-        cleaned_data['Characters'] = cleaned_characters
-
-        # Include "Locations" if necessary
-        if 'Locations' in dialogue_data:
-            cleaned_data['Locations'] = dialogue_data['Locations']
-
-        return cleaned_data
+        return clean_dialogue_data(dialogue_data)
@@ -0,0 +1,401 @@
+# graph.py
+import logging
+from array import array
+from typing import Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from .models import Connection
+
+
+NO_NODE = -1  # Column value of a connection end that is missing
+
+
+def pack_connection_id(connection_id) -> int:
+    """Articy Ids such as 0x0100000000001F2A as the integer they spell, 0 for anything else."""
+    if connection_id and len(connection_id) == 18 and connection_id.startswith('0x'):
+        try:
+            value = int(connection_id, 16)
+        except ValueError:
+            return 0
+        if value and f'0x{value:016X}' == connection_id:
+            return value
+    return 0
+
+
+class ConnectionGraph:
+    """
+    The connections of a parsed project, stored as integer columns and CSR-style adjacency arrays.
+    Every fragment and every connection end gets a dense index into ids, fragments first. Each
+    connection is a row of the connection_sources, connection_targets, connection_source_pins and
+    connection_target_pins columns (NO_NODE when the end is missing), in export order, its Id packed
+    into connection_ids when it has the usual 0x + 16 hex digits form, kept in other_connection_ids
+    otherwise.
+    The targets of node i are forward_targets[forward_offsets[i]:forward_offsets[i + 1]], in connection
+    order, and the backward arrays list the sources the same way. The pin arrays do the same from an
+    output pin to the targets and from an input pin to the sources. The arrays support the buffer
+    protocol, so whole-project metrics can be computed on them without copies
+    (e.g. numpy.frombuffer(graph.forward_offsets, dtype=numpy.int64)).
+    """
+
+    def __init__(self, fragment_ids=(), connections=()):
+        self.ids: List[str] = list(fragment_ids)
+        self.index_of: Dict[str, int] = {node_id: index for index, node_id in enumerate(self.ids)}
+        self.fragment_count = len(self.ids)  # Nodes below this index are fragments
+        self.connection_ids = array('Q')
+        self.other_connection_ids: Dict[int, Optional[str]] = {}  # Row -> Id not packed in connection_ids
+        self.connection_sources = array('i')
+        self.connection_targets = array('i')
+        self.connection_source_pins = array('i')
+        self.connection_target_pins = array('i')
+        for conn in connections:
+            self.append_connection(conn)
+        self.build_adjacency()
+        logging.info(f"Connection graph: {len(self.ids)} nodes, {len(self.connection_ids)} connections")
+
+    def patched(self, fragment_ids, rows) -> 'ConnectionGraph':
+        """
+        A graph over the given fragments whose connections are the items of rows, in order: either the
+        number of a row of this graph, kept as it is, or a Connection. Kept rows are copied column by
+        column, their node indices translated, without building their connections.
+        """
+        graph = ConnectionGraph(fragment_ids)
+        for node_id in self.ids:
+            graph.add_node(node_id)
+        # Old node index -> new one, the trailing NO_NODE maps a missing end (index -1) to itself
+        new_index = array('i', (graph.index_of[node_id] for node_id in self.ids))
+        new_index.append(NO_NODE)
+        columns = (
+            (self.connection_sources, graph.connection_sources),
+            (self.connection_targets, graph.connection_targets),
+            (self.connection_source_pins, graph.connection_source_pins),
+            (self.connection_target_pins, graph.connection_target_pins),
+        )
+
+        def copy_rows(start, end):
+            for row, connection_id in self.other_connection_ids.items():
+                if start <= row < end:
+                    graph.other_connection_ids[len(graph.connection_ids) + row - start] = connection_id
+            graph.connection_ids.extend(self.connection_ids[start:end])
+            for old_column, new_column in columns:
+                new_column.extend(map(new_index.__getitem__, old_column[start:end]))
+
+        run_start = run_end = 0  # Kept rows are copied by runs of consecutive rows
+        for row in rows:
+            if isinstance(row, int) and row == run_end and run_end > run_start:
+                run_end += 1
+                continue
+            copy_rows(run_start, run_end)
+            if isinstance(row, int):
+                run_start, run_end = row, row + 1
+            else:
+                run_start = run_end = 0
+                graph.append_connection(row)
+        copy_rows(run_start, run_end)
+        graph.build_adjacency()
+        logging.info(f"Connection graph patched: {len(graph.ids)} nodes, {len(graph.connection_ids)} connections")
+        return graph
+
+    def __getstate__(self):
+        # index_of is most of the size and is rebuilt from ids
+        state = dict(self.__dict__)
+        del state['index_of']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index_of = {node_id: index for index, node_id in enumerate(self.ids)}
+
+    def add_node(self, node_id):
+        if node_id is None:
+            return NO_NODE
+        index = self.index_of.get(node_id)
+        if index is None:
+            index = len(self.ids)
+            self.index_of[node_id] = index
+            self.ids.append(node_id)
+        return index
+
+    def append_connection(self, conn: Connection):
+        packed_id = pack_connection_id(conn.Id)
+        if not packed_id:
+            self.other_connection_ids[len(self.connection_ids)] = conn.Id
+        self.connection_ids.append(packed_id)
+        self.connection_sources.append(self.add_node(conn.Source))
+        self.connection_targets.append(self.add_node(conn.Target))
+        self.connection_source_pins.append(self.add_node(conn.SourcePin))
+        self.connection_target_pins.append(self.add_node(conn.TargetPin))
+
+    def build_adjacency(self):
+        sources, targets = self.connection_sources, self.connection_targets
+        self.forward_offsets, self.forward_targets = self.compress(sources, targets)
+        self.backward_offsets, self.backward_sources = self.compress(targets, sources)
+        self.pin_forward_offsets, self.pin_forward_targets = self.compress(self.connection_source_pins, targets)
+        self.pin_backward_offsets, self.pin_backward_sources = self.compress(self.connection_target_pins, sources)
+
+    def compress(self, keys, values):
+        """
+        Counting sort of the (key, value) pairs by key into an offsets array and a values array.
+        Pairs missing their key or value are left out.
+        """
+        offsets = array('q', bytes(8 * (len(self.ids) + 1)))
+        for key, value in zip(keys, values):
+            if key != NO_NODE and value != NO_NODE:
+                offsets[key + 1] += 1
+        for index in range(len(self.ids)):
+            offsets[index + 1] += offsets[index]
+        positions = offsets[:-1]
+        sorted_values = array('i', bytes(4 * offsets[-1]))
+        for key, value in zip(keys, values):
+            if key != NO_NODE and value != NO_NODE:
+                sorted_values[positions[key]] = value
+                positions[key] += 1
+        return offsets, sorted_values
+
+    def __len__(self):
+        return len(self.connection_ids)
+
+    def node_id(self, index) -> Optional[str]:
+        return self.ids[index] if index != NO_NODE else None
+
+    def connection_id(self, row) -> Optional[str]:
+        if row in self.other_connection_ids:
+            return self.other_connection_ids[row]
+        return f'0x{self.connection_ids[row]:016X}'
+
+    def connection(self, row) -> Connection:
+        """The connection of a row, built on demand."""
+        return Connection(
+            Source=self.node_id(self.connection_sources[row]),
+            Target=self.node_id(self.connection_targets[row]),
+            Id=self.connection_id(row),
+            SourcePin=self.node_id(self.connection_source_pins[row]),
+            TargetPin=self.node_id(self.connection_target_pins[row])
+        )
+
+    def connections(self) -> Iterator[Connection]:
+        """Every connection in export order, built on demand."""
+        return (self.connection(row) for row in range(len(self.connection_ids)))
+
+    def is_fragment(self, index) -> bool:
+        return index < self.fragment_count
+
+    def target_indices(self, index) -> array:
+        return self.forward_targets[self.forward_offsets[index]:self.forward_offsets[index + 1]]
+
+    def source_indices(self, index) -> array:
+        return self.backward_sources[self.backward_offsets[index]:self.backward_offsets[index + 1]]
+
+    def targets(self, node_id) -> List[str]:
+        """IDs of the targets of the connections leaving the node, in connection order."""
+        index = self.index_of.get(node_id)
+        return [self.ids[target] for target in self.target_indices(index)] if index is not None else []
+
+    def sources(self, node_id) -> List[str]:
+        """IDs of the sources of the connections reaching the node, in connection order."""
+        index = self.index_of.get(node_id)
+        return [self.ids[source] for source in self.source_indices(index)] if index is not None else []
+
+    def pin_targets(self, pin_id) -> List[str]:
+        """IDs of the targets of the connections leaving an output pin."""
+        index = self.index_of.get(pin_id)
+        if index is None:
+            return []
+        offsets = self.pin_forward_offsets
+        return [self.ids[target] for target in self.pin_forward_targets[offsets[index]:offsets[index + 1]]]
+
+    def pin_sources(self, pin_id) -> List[str]:
+        """IDs of the sources of the connections reaching an input pin."""
+        index = self.index_of.get(pin_id)
+        if index is None:
+            return []
+        offsets = self.pin_backward_offsets
+        return [self.ids[source] for source in self.pin_backward_sources[offsets[index]:offsets[index + 1]]]
+
+    def out_degree(self, node_id) -> int:
+        index = self.index_of.get(node_id)
+        return self.forward_offsets[index + 1] - self.forward_offsets[index] if index is not None else 0
+
+    def in_degree(self, node_id) -> int:
+        index = self.index_of.get(node_id)
+        return self.backward_offsets[index + 1] - self.backward_offsets[index] if index is not None else 0
+
+    def out_degrees(self) -> array:
+        """Out-degree of every node, by index."""
+        offsets = self.forward_offsets
+        return array('q', (offsets[index + 1] - offsets[index] for index in range(len(self.ids))))
+
+    def in_degrees(self) -> array:
+        """In-degree of every node, by index."""
+        offsets = self.backward_offsets
+        return array('q', (offsets[index + 1] - offsets[index] for index in range(len(self.ids))))
+
+
+class DialogueGraph:
+    """
+    Precomputed analysis of the fragment graph of a parsed project.
+    Only fragment -> fragment connections are considered, like DialogueFlowExtractor does when it
+    walks a flow. Strongly connected components, the condensed DAG in both directions and a
+    topological order are computed once. Reachability is answered by walking the condensed DAG, which
+    is much smaller than the fragment graph: forward from the starting components of a dialogue, or
+    backward to the components where dialogues start. Each answer is memoized, so memory only grows
+    with the questions asked, not with components x dialogues.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.connection_graph: ConnectionGraph = parser.connection_graph
+        self.components: List[List[str]] = []
+        self.component_of: Dict[str, int] = {}
+        self.component_edges: List[Tuple[int, ...]] = []
+        self.component_predecessors: List[Tuple[int, ...]] = []
+        self.topological_order: List[int] = []
+        self.loops: List[List[str]] = []
+        self.loop_components: Set[int] = set()
+        self.starting_dialogues: Dict[int, List[str]] = {}  # Component -> dialogues starting in it
+        self.dialogue_components: Dict[str, FrozenSet[int]] = {}  # Memoized by reachable_components
+        self.dialogue_reachable: Dict[str, FrozenSet[str]] = {}
+        self.component_dialogue_ids: Dict[int, FrozenSet[str]] = {}
+        self.build()
+
+    def build(self):
+        logging.info("Analysing dialogue graph...")
+        self.find_components()
+        self.condense()
+        self.index_starting_dialogues()
+        logging.info(f"Dialogue graph: {len(self.components)} components, {len(self.loops)} loops")
+
+    def successors(self, index) -> List[int]:
+        """Indices of the fragments the fragment at index connects to."""
+        fragment_count = self.connection_graph.fragment_count
+        return [target for target in self.connection_graph.target_indices(index) if target < fragment_count]
+
+    def find_components(self):
+        """Tarjan's algorithm with an explicit stack, components come out in reverse topological order."""
+        ids = self.connection_graph.ids
+        fragment_count = self.connection_graph.fragment_count
+        index_of = [-1] * fragment_count
+        lowlink = [0] * fragment_count
+        on_stack = bytearray(fragment_count)
+        component_stack = []
+        next_index = 0
+
+        for root in range(fragment_count):
+            if index_of[root] != -1:
+                continue
+            index_of[root] = lowlink[root] = next_index
+            next_index += 1
+            component_stack.append(root)
+            on_stack[root] = 1
+            work = [(root, iter(self.successors(root)))]
+            while work:
+                node, targets = work[-1]
+                for target in targets:
+                    if index_of[target] == -1:
+                        index_of[target] = lowlink[target] = next_index
+                        next_index += 1
+                        component_stack.append(target)
+                        on_stack[target] = 1
+                        work.append((target, iter(self.successors(target))))
+                        break
+                    if on_stack[target]:
+                        lowlink[node] = min(lowlink[node], index_of[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index_of[node]:
+                        component = []
+                        while True:
+                            member = component_stack.pop()
+                            on_stack[member] = 0
+                            self.component_of[ids[member]] = len(self.components)
+                            component.append(ids[member])
+                            if member == node:
+                                break
+                        self.components.append(component)
+
+    def condense(self):
+        index_of = self.connection_graph.index_of
+        component_edges = [set() for _ in self.components]
+        component_predecessors = [set() for _ in self.components]
+        for component_index, component in enumerate(self.components):
+            for fragment_id in component:
+                for target in self.successors(index_of[fragment_id]):
+                    target_component = self.component_of[self.connection_graph.ids[target]]
+                    if target_component != component_index:
+                        component_edges[component_index].add(target_component)
+                        component_predecessors[target_component].add(component_index)
+            # A component is a loop if it has several fragments or a fragment connected to itself
+            first = index_of[component[0]]
+            if len(component) > 1 or first in self.successors(first):
+                self.loops.append(component)
+                self.loop_components.add(component_index)
+        self.component_edges = [tuple(edges) for edges in component_edges]
+        self.component_predecessors = [tuple(predecessors) for predecessors in component_predecessors]
+        self.topological_order = list(reversed(range(len(self.components))))
+
+    def index_starting_dialogues(self):
+        for dialogue_id, dialogue in self.parser.dialogues.items():
+            for fragment_id in dialogue.StartingFragments:
+                component_index = self.component_of.get(fragment_id)
+                if component_index is not None:
+                    self.starting_dialogues.setdefault(component_index, []).append(dialogue_id)
+
+    @staticmethod
+    def walk(start, edges) -> Set[int]:
+        """Components reachable from the start components along edges, the start included."""
+        pending = list(start)
+        seen = set(pending)
+        while pending:
+            for next_component in edges[pending.pop()]:
+                if next_component not in seen:
+                    seen.add(next_component)
+                    pending.append(next_component)
+        return seen
+
+    def reachable_components(self, dialogue_id) -> FrozenSet[int]:
+        components = self.dialogue_components.get(dialogue_id)
+        if components is None:
+            dialogue = self.parser.dialogues.get(dialogue_id)
+            start = {self.component_of[fragment_id] for fragment_id in dialogue.StartingFragments
+                     if fragment_id in self.component_of} if dialogue is not None else ()
+            components = frozenset(self.walk(start, self.component_edges))
+            self.dialogue_components[dialogue_id] = components
+        return components
+
+    def reachable_fragments(self, dialogue_id) -> FrozenSet[str]:
+        """Fragments reachable from the starting fragments of the dialogue."""
+        reachable = self.dialogue_reachable.get(dialogue_id)
+        if reachable is None:
+            reachable = frozenset(fragment_id for component_index in self.reachable_components(dialogue_id)
+                                  for fragment_id in self.components[component_index])
+            self.dialogue_reachable[dialogue_id] = reachable
+        return reachable
+
+    def dialogues_leading_to(self, fragment_id) -> FrozenSet[str]:
+        """Dialogues from which the fragment can be reached."""
+        component_index = self.component_of.get(fragment_id)
+        if component_index is None:
+            return frozenset()
+        dialogue_ids = self.component_dialogue_ids.get(component_index)
+        if dialogue_ids is None:
+            ancestors = self.walk((component_index,), self.component_predecessors)
+            dialogue_ids = frozenset(dialogue_id for ancestor in ancestors
+                                     for dialogue_id in self.starting_dialogues.get(ancestor, ()))
+            self.component_dialogue_ids[component_index] = dialogue_ids
+        return dialogue_ids
+
+    def is_reachable(self, dialogue_id, fragment_id) -> bool:
+        component_index = self.component_of.get(fragment_id)
+        if component_index is None:
+            return False
+        return component_index in self.reachable_components(dialogue_id)
+
+    def in_loop(self, fragment_id) -> bool:
+        component_index = self.component_of.get(fragment_id)
+        return component_index in self.loop_components
+
+    def topological_fragments(self) -> List[str]:
+        """Fragments ordered so that every connection outside a loop goes forward."""
+        return [fragment_id for component_index in self.topological_order
+                for fragment_id in self.components[component_index]]
@@ -2,11 +2,17 @@
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
 
-@dataclass
+from .spans import ElementSpan
+from .utils import xml_to_dict
+
+# Slotted: a large project holds hundreds of thousands of fragments and connections, a per-instance
+# __dict__ would be most of the parsed model's memory. asdict works on them as on plain dataclasses.
+
+@dataclass(slots=True)
 class Feature:
     Properties: Dict[str, Any]
 
-@dataclass
+@dataclass(slots=True)
 class Entity:
     Id: str
     DisplayName: str
@@ -14,20 +20,49 @@ class Entity:
     Features: List[Feature] = field(default_factory=list)
     References: List[Any] = field(default_factory=list)
 
-@dataclass
+@dataclass(eq=False, slots=True)
 class Location:
+    """
+    Data is the location element converted with xml_to_dict. When Source is set it is only read back
+    from the XML file and converted on first access, then kept; otherwise it is given at creation.
+    Locations compare on Id, Name and the digest of their element rather than on Data.
+    """
     Id: str
     Name: str
-    Data: Dict[str, Any]
+    Source: Optional[ElementSpan] = None
+    cached_data: Optional[Dict[str, Any]] = field(default=None, repr=False)
 
-@dataclass
+    @property
+    def Data(self) -> Dict[str, Any]:
+        if self.cached_data is None:
+            element = self.Source.parse(self.Id, 'Location') if self.Source is not None else None
+            self.cached_data = xml_to_dict(element, None) if element is not None else {}
+        return self.cached_data
+
+    def __eq__(self, other):
+        if not isinstance(other, Location):
+            return NotImplemented
+        if self.Id != other.Id or self.Name != other.Name:
+            return False
+        if self.Source is not None and other.Source is not None:
+            return self.Source == other.Source
+        return self.Data == other.Data
+
+    def __getstate__(self):
+        # Data that can be read back from the file is not worth pickling
+        return self.Id, self.Name, self.Source, self.cached_data if self.Source is None else None
+
+    def __setstate__(self, state):
+        self.Id, self.Name, self.Source, self.cached_data = state
+
+@dataclass(slots=True)
 class Dialogue:
     Id: str
     DisplayName: str
     Text: str
     StartingFragments: List[str] = field(default_factory=list)
 
-@dataclass
+@dataclass(slots=True)
 class Fragment:
     Id: str
     DisplayName: str
@@ -35,7 +70,37 @@ class Fragment:
     SpeakerId: Optional[str]
     SpeakerName: str
 
-@dataclass
+@dataclass(slots=True)
 class Connection:
     Source: str
     Target: str
+    Id: Optional[str] = None
+    SourcePin: Optional[str] = None
+    TargetPin: Optional[str] = None
+
+@dataclass
+class ParseDelta:
+    """Ids of the objects added, removed or modified by an incremental reload, per object kind."""
+    added: Dict[str, List[str]] = field(default_factory=dict)
+    removed: Dict[str, List[str]] = field(default_factory=dict)
+    modified: Dict[str, List[str]] = field(default_factory=dict)
+
+    def record(self, kind: str, added: List[str], removed: List[str], modified: List[str]):
+        self.added[kind] = added
+        self.removed[kind] = removed
+        self.modified[kind] = modified
+
+    def is_empty(self) -> bool:
+        return not any(ids for changes in (self.added, self.removed, self.modified) for ids in changes.values())
+
+    def changed_ids(self, kind: str) -> List[str]:
+        """Ids of the objects of a kind added, removed or modified."""
+        return self.added.get(kind, []) + self.removed.get(kind, []) + self.modified.get(kind, [])
+
+    def summary(self) -> str:
+        if self.is_empty():
+            return "No changes."
+        return ", ".join(
+            f"{kind}: +{len(self.added[kind])} -{len(self.removed[kind])} ~{len(self.modified[kind])}"
+            for kind in self.added
+        )
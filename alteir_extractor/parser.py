@@ -1,37 +1,436 @@
 # parser.py
 import xml.etree.ElementTree as ET
-from typing import Dict, List
-from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
 import logging
 import sys
+from array import array
+from dataclasses import asdict, replace
 
-from .models import Entity, Location, Dialogue, Fragment, Connection, Feature
-from .utils import extract_speaker_from_displayname, xml_to_dict
+from .models import Entity, Location, Dialogue, Fragment, Connection, Feature, ParseDelta
+from .utils import extract_speaker_from_displayname, intern_id, xml_to_dict
+from .cache import ParseCache, file_stamp, stamp_matches
+from .spans import ElementSpan, ScannedElements, SpanReader, scan_elements
+from .graph import ConnectionGraph, DialogueGraph
 
 class AlteirXMLParser:
+    # Parsed model kept by the parse cache, everything else is rebuilt from it
+    MODEL_ATTRIBUTES = (
+        'dialogues', 'fragments', 'connection_graph', 'entities', 'locations', 'flow_fragments',
+        'flow_fragment_location_refs', 'dialogue_output_pins', 'parents', 'file_stamp', 'object_digests',
+    )
+    MAX_REVISION_CHANGES = 16  # Reloads whose changed nodes are remembered for the caches built on the model
+    # Local name of the elements of each kind of object kept by Id, with the model attribute holding them
+    OBJECT_ELEMENTS = {
+        'Entity': 'entities', 'Location': 'locations', 'FlowFragment': 'flow_fragment_location_refs',
+        'Dialogue': 'dialogues', 'DialogueFragment': 'fragments',
+    }
+    SCANNED_ELEMENTS = tuple(OBJECT_ELEMENTS) + ('Connection', 'Hierarchy')
+    MAX_RELOADED_SHARE = 0.5  # Share of the scanned bytes above which a reload parses the whole file again
+
     def __init__(self, file_path: str):
         self.file_path = file_path
+        self.file_stamp = None  # Version of the file the model was parsed from, see cache.file_stamp
         self.namespace = {'ns': 'http://www.articy.com/schemas/articydraft/4.0/XmlContentExport_FullProject.xsd'}
         self.dialogues: Dict[str, Dialogue] = {}
         self.fragments: Dict[str, Fragment] = {}
-        self.connections: List[Connection] = []
+        # Connections and their adjacency in both directions, by source/target and by pin, see ConnectionGraph
+        self.connection_graph = ConnectionGraph()
         self.entities: Dict[str, Entity] = {}
         self.locations: Dict[str, Location] = {}
         self.flow_fragments: Dict[str, List[str]] = {}
-        self.source_to_targets: Dict[str, List[str]] = defaultdict(list)
+        # References captured while parsing, resolved once every object has been read
+        self.flow_fragment_location_refs: Dict[str, List[str]] = {}
+        self.dialogue_output_pins: Dict[str, List[str]] = {}
+        # Containing object of each object, from the Hierarchy section of the export
+        self.parents: Dict[str, str] = {}
+        # Digest of each element in SCANNED_ELEMENTS, in the order of the model, for reloads to skip unchanged ones
+        self.object_digests: Dict[str, array] = {}
+        self.location_spans = {}  # Raw byte spans of the location elements, only needed while parsing
+        self.parsed_connections: List[Connection] = []  # Only while parsing, then stored in connection_graph
+        self.dialogue_graph = None  # Built on first use by get_dialogue_graph
+        self.entity_dicts: Dict[str, dict] = {}  # Filled on first use by get_entity_dict
+        self.object_location_refs: Dict[str, List[str]] = {}  # Filled on first use by find_related_locations
+        self.revision = 0  # Bumped whenever the model changes, lets caches built on it expire
+        # (revision, fragment and connection end IDs changed by it) of the last reloads, see changes_since
+        self.revision_changes: List[Tuple[int, FrozenSet[str]]] = []
         self.tree = None
         self.root = None
 
-    def parse(self):
-        self.load_xml()
-        self.extract_entities()
-        self.extract_locations()
-        self.extract_flow_fragments()
-        self.extract_dialogues()
-        self.extract_fragments()
-        self.extract_connections()
-        self.build_source_to_targets()
+    def parse(self, streaming: bool = False):
+        self.stamp_file()
+        self.parse_objects(streaming=streaming)
         self.identify_starting_fragments()
+        self.model_changed()
+
+    def parse_objects(self, streaming: bool = False):
+        """Read every object of the export and store the connections, without the derived indexes."""
+        scan = self.scan_objects()
+        self.read_objects(streaming, scan)
+        self.connection_graph = ConnectionGraph(self.fragments, self.parsed_connections)
+        self.parsed_connections = []
+        self.record_digests(scan)
+
+    def read_objects(self, streaming: bool, scan: Optional[Dict[str, ScannedElements]]):
+        """Read every object of the export, the connections are left in parsed_connections."""
+        self.location_spans = scan['Location'].spans() if scan is not None else {}
+        if streaming:
+            self.stream_xml()
+        else:
+            self.load_xml()
+            self.walk_tree()
+        self.resolve_references()
+        self.location_spans = {}
+
+    def stamp_file(self):
+        """Record the version of the file about to be read, before reading it."""
+        try:
+            self.file_stamp = file_stamp(self.file_path)
+        except OSError as e:
+            logging.warning(f"Could not stamp {self.file_path}, it will always be reloaded: {e}")
+            self.file_stamp = None
+
+    def scan_objects(self) -> Optional[Dict[str, ScannedElements]]:
+        """
+        Find the byte span and digest of every object element, so location Data is only converted when
+        read and reloads only parse the elements that changed. None if the file could not be scanned.
+        """
+        try:
+            return scan_elements(self.file_path, self.SCANNED_ELEMENTS)
+        except OSError as e:
+            logging.warning(f"Could not scan {self.file_path}, location data is read eagerly: {e}")
+            return None
+
+    def record_digests(self, scan: Optional[Dict[str, ScannedElements]]):
+        """
+        Keep the digests of the scanned elements when they line up with the objects of the model, one
+        digest per object in the order of the model. A kind whose elements do not, such as with missing
+        or duplicate Ids, keeps no digests and is parsed whole by the next reload.
+        """
+        self.object_digests = {}
+        if scan is None:
+            return
+        for local_name, attribute in self.OBJECT_ELEMENTS.items():
+            if scan[local_name].ids == list(getattr(self, attribute)):
+                self.object_digests[local_name] = scan[local_name].digests
+        connection_ids = scan['Connection'].ids
+        if len(connection_ids) == len(self.connection_graph) and None not in connection_ids \
+                and len(set(connection_ids)) == len(connection_ids):
+            self.object_digests['Connection'] = scan['Connection'].digests
+        self.object_digests['Hierarchy'] = scan['Hierarchy'].digests
+
+    def object_ids(self, local_name) -> List[Optional[str]]:
+        """Ids of the objects whose digests are in object_digests, in the same order."""
+        if local_name == 'Connection':
+            return [self.connection_graph.connection_id(row) for row in range(len(self.connection_graph))]
+        return list(getattr(self, self.OBJECT_ELEMENTS[local_name]))
+
+    def changed_spans(self, scan: Dict[str, ScannedElements]) -> Tuple[Optional[List[ElementSpan]], Set[str]]:
+        """
+        Spans of the elements whose digest changed since the model was parsed, or that were added, in
+        file order, with the local names parsed whole because their digests are not known or the Hierarchy
+        changed. The spans are None when they cover most of the file, parsing it whole is then cheaper.
+        """
+        spans = []
+        whole = set()
+        for local_name in self.SCANNED_ELEMENTS:
+            elements = scan[local_name]
+            digests = self.object_digests.get(local_name)
+            if local_name == 'Hierarchy':
+                parse_whole = digests != elements.digests
+            else:
+                parse_whole = digests is None or (local_name == 'Connection' and None in elements.ids)
+            if parse_whole:
+                whole.add(local_name)
+                changed = range(len(elements))
+            elif local_name == 'Hierarchy':
+                changed = ()
+            else:
+                old_digests = dict(zip(self.object_ids(local_name), digests))
+                changed = [index for index, (element_id, digest) in enumerate(zip(elements.ids, elements.digests))
+                           if old_digests.get(element_id) != digest]
+            spans.extend(elements.span(index) for index in changed)
+        scanned_size = sum(sum(elements.ends) - sum(elements.starts) for elements in scan.values())
+        if sum(span.end - span.start for span in spans) > scanned_size * self.MAX_RELOADED_SHARE:
+            return None, set(self.SCANNED_ELEMENTS)
+        spans.sort(key=lambda span: span.start)
+        return spans, whole
+
+    def parse_spans(self, spans: List[ElementSpan]) -> bool:
+        """Read only the objects of the given element spans, False if the file changed under them."""
+        reader = SpanReader(self.file_path, spans)
+        self.stream_xml(reader)
+        return not reader.stale
+
+    def reload(self, streaming: bool = True) -> ParseDelta:
+        """
+        Re-read the XML file and patch the model in place with the objects that were added, removed
+        or modified since the last parse, matched by Id. The file is scanned for the digest of every
+        object element: only the elements that changed are parsed, and the Hierarchy section if it
+        changed, the other objects are kept as they are. When most of the file changed, or digests are
+        not known, the whole file is parsed again instead.
+        The connection graph is patched only if connections or fragments were added, removed or changed,
+        keeping the rows of unchanged connections, and only the starting fragments, entity dicts,
+        dialogue graph and cached flows that the changes touch are dropped, see model_changed. When
+        connections or fragments moved in the file the graph is built again and everything derived
+        from it is recomputed.
+        """
+        logging.info(f"Reloading XML file: {self.file_path}")
+        self.stamp_file()
+        scan = self.scan_objects()
+        fresh = AlteirXMLParser(self.file_path)
+        spans, whole = self.changed_spans(scan) if scan is not None else (None, set(self.SCANNED_ELEMENTS))
+        if spans is not None:
+            logging.info(f"Parsing the {len(spans)} changed elements")
+            fresh.location_spans = scan['Location'].spans()
+            if not fresh.parse_spans(spans):
+                logging.warning(f"{self.file_path} changed while it was reloaded, parsing it whole")
+                self.stamp_file()
+                scan = self.scan_objects()
+                spans = None
+                whole = set(self.SCANNED_ELEMENTS)
+                fresh = AlteirXMLParser(self.file_path)
+        if spans is None:
+            fresh.read_objects(streaming, scan)
+        delta = ParseDelta()
+
+        def scanned_ids(local_name):
+            return None if local_name in whole else scan[local_name].ids
+
+        added_entities, removed_entities, modified_entities = self.patch_objects(
+            'Entities', self.entities, fresh.entities, delta, scanned_ids('Entity')
+        )
+        self.patch_objects('Locations', self.locations, fresh.locations, delta, scanned_ids('Location'))
+        if scan is not None:
+            # Unchanged locations may have moved in the file, their data is read at the new offsets
+            location_spans = fresh.location_spans or scan['Location'].spans()
+            for location_id, location in self.locations.items():
+                location.Source = location_spans.get(location_id, location.Source)
+
+        # Speakers are resolved against the whole model, fragments whose speaker changed are compared again
+        changed_entities = set(added_entities) | set(removed_entities) | set(modified_entities)
+        if 'DialogueFragment' not in whole:
+            for fragment_id, fragment in self.fragments.items():
+                if fragment.SpeakerId in changed_entities and fragment_id not in fresh.fragments:
+                    fresh.fragments[fragment_id] = replace(fragment)
+        for fragment in fresh.fragments.values():
+            self.resolve_speaker(fragment)
+        added_fragments, removed_fragments, modified_fragments = self.patch_objects(
+            'Fragments', self.fragments, fresh.fragments, delta, scanned_ids('DialogueFragment')
+        )
+
+        # Starting fragments are derived, dialogues compare on their own fields and output pins
+        def same_dialogue(old, new):
+            return (old.DisplayName == new.DisplayName and old.Text == new.Text
+                    and self.dialogue_output_pins.get(old.Id) == fresh.dialogue_output_pins.get(new.Id))
+
+        added_dialogues, _, modified_dialogues = self.patch_objects(
+            'Dialogues', self.dialogues, fresh.dialogues, delta, scanned_ids('Dialogue'), same=same_dialogue
+        )
+        self.dialogue_output_pins = {
+            dialogue_id: fresh.dialogue_output_pins[dialogue_id] if dialogue_id in fresh.dialogue_output_pins
+            else self.dialogue_output_pins.get(dialogue_id, [])
+            for dialogue_id in self.dialogues
+        }
+        flow_fragment_ids = scanned_ids('FlowFragment')
+        self.flow_fragment_location_refs = {
+            intern_id(fragment_id): fresh.flow_fragment_location_refs[fragment_id]
+            if fragment_id in fresh.flow_fragment_location_refs else self.flow_fragment_location_refs.get(fragment_id, [])
+            for fragment_id in (flow_fragment_ids if flow_fragment_ids is not None else fresh.flow_fragment_location_refs)
+        }
+        self.resolve_flow_fragment_locations()
+        if 'Hierarchy' in whole:
+            self.parents = fresh.parents
+        self.object_location_refs = {}
+
+        graph = self.connection_graph
+        changed_connections, moved_connections = self.patch_connections(
+            fresh.parsed_connections, delta, scanned_ids('Connection'),
+            rebuild=list(self.fragments) != graph.ids[:graph.fragment_count]
+        )
+        self.record_digests(scan)
+
+        # Starting fragments follow the pin connections: all are recomputed when the graph was rebuilt,
+        # otherwise only those of the dialogues whose pins may have changed
+        if self.connection_graph is not graph:
+            self.dialogue_graph = None
+            self.identify_starting_fragments()
+        else:
+            self.identify_starting_fragments(added_dialogues + modified_dialogues)
+        if moved_connections:
+            # Flows follow the connections in file order, which nodes they went through is not known
+            self.model_changed()
+        elif not delta.is_empty() or self.connection_graph is not graph:
+            changed_nodes = set(added_fragments) | set(removed_fragments) | set(modified_fragments)
+            for conn in changed_connections:
+                changed_nodes.update((conn.Source, conn.Target))
+            self.model_changed(delta, changed_nodes)
+
+        logging.info(f"Reload complete: {delta.summary()}")
+        return delta
+
+    def patch_objects(self, kind, current, fresh, delta, ids=None, same=None):
+        """
+        Rebuild the current Id-keyed objects in file order from a fresh parse and record the changes.
+        ids lists the Ids in file order when fresh only holds the objects whose element changed, the
+        others are kept from the current model; without it fresh holds every object.
+        """
+        same = same or (lambda old, new: old == new)
+        added = []
+        modified = []
+        patched = {}
+        for obj_id in (ids if ids is not None else fresh):
+            if obj_id in patched:
+                continue
+            obj = fresh.get(obj_id)
+            old = current.get(obj_id)
+            if obj is None:
+                obj = old
+                if obj is None:
+                    continue
+            elif old is None:
+                added.append(obj_id)
+            elif same(old, obj):
+                obj = old
+            else:
+                modified.append(obj_id)
+            patched[intern_id(obj_id)] = obj
+        removed = [obj_id for obj_id in current if obj_id not in patched]
+        current.clear()
+        current.update(patched)
+        delta.record(kind, added, removed, modified)
+        return added, removed, modified
+
+    @staticmethod
+    def connection_key(conn):
+        return conn.Id if conn.Id else f"{conn.Source}->{conn.Target}"
+
+    def patch_connections(self, fresh_connections, delta, ids=None, rebuild=False):
+        """
+        Rebuild the connection graph from the connections of a fresh parse and record the changes.
+        ids lists the connection Ids in file order when fresh_connections only holds the connections whose
+        element changed, the others are kept from the current graph; without it fresh_connections holds
+        every connection. The graph is kept when no connection changed or moved, unless rebuild is set
+        because the fragments, its first nodes, changed. Returns the changed connections and whether
+        kept connections moved in the file, which changes the order flows follow them in.
+        """
+        graph = self.connection_graph
+        whole = ids is None
+        fresh_by_key = {self.connection_key(conn): conn for conn in fresh_connections}
+        if whole:
+            old_keys = [self.connection_key(conn) for conn in graph.connections()]
+            ids = [self.connection_key(conn) for conn in fresh_connections]
+        else:
+            old_keys = [graph.connection_id(row) for row in range(len(graph))]
+        old_rows = {key: row for row, key in enumerate(old_keys)}
+        new_keys = set(ids)
+        removed = [key for key in old_rows if key not in new_keys]
+        added = [key for key in fresh_by_key if key not in old_rows]
+        modified = [key for key, conn in fresh_by_key.items()
+                    if key in old_rows and graph.connection(old_rows[key]) != conn]
+        changed = [graph.connection(old_rows[key]) for key in removed + modified] + \
+                  [fresh_by_key[key] for key in added + modified]
+        moved = [key for key in old_keys if key in new_keys] != [key for key in ids if key in old_rows]
+        delta.record('Connections', added, removed, modified)
+        if whole and (changed or moved or rebuild):
+            self.connection_graph = ConnectionGraph(self.fragments, fresh_connections)
+        elif changed or moved or rebuild:
+            self.connection_graph = graph.patched(self.fragments, (
+                fresh_by_key[key] if key in fresh_by_key else old_rows[key] for key in ids
+            ))
+        return changed, moved
+
+    def get_model_state(self):
+        return {name: getattr(self, name) for name in self.MODEL_ATTRIBUTES}
+
+    def set_model_state(self, state):
+        for name in self.MODEL_ATTRIBUTES:
+            setattr(self, name, state[name])
+        self.model_changed()
+
+    def model_changed(self, delta: Optional[ParseDelta] = None, changed_nodes: Optional[Set[str]] = None):
+        """
+        Drop what was derived from the previous model and let external caches know it changed.
+        Without a delta everything is dropped. After a reload only what the delta touches is: the dicts
+        of the changed entities, and the dialogue graph if fragments, connections or dialogues changed.
+        changed_nodes is remembered for changes_since, so a FlowCache only drops the flows going through them.
+        """
+        self.revision += 1
+        self.object_location_refs = {}
+        if delta is None:
+            self.dialogue_graph = None
+            self.entity_dicts = {}
+            self.revision_changes = []
+            return
+        for entity_id in delta.changed_ids('Entities'):
+            self.entity_dicts.pop(entity_id, None)
+        if any(delta.changed_ids(kind) for kind in ('Fragments', 'Connections', 'Dialogues')):
+            self.dialogue_graph = None
+        self.revision_changes.append((self.revision, frozenset(changed_nodes or ())))
+        del self.revision_changes[:-self.MAX_REVISION_CHANGES]
+
+    def changes_since(self, revision) -> Optional[Set[str]]:
+        """
+        Fragment and connection end IDs changed by the reloads since the given revision, None when they
+        are not known, such as across a full parse.
+        """
+        changed = set()
+        expected = revision + 1
+        for change_revision, node_ids in self.revision_changes:
+            if change_revision < expected:
+                continue
+            if change_revision != expected:
+                return None
+            changed |= node_ids
+            expected += 1
+        return changed if expected == self.revision + 1 else None
+
+    def get_entity_dict(self, entity_id):
+        """Export form of an entity, converted with asdict once per entity per parse. Must not be modified."""
+        entity_dict = self.entity_dicts.get(entity_id)
+        if entity_dict is None:
+            entity_dict = asdict(self.entities[entity_id])
+            self.entity_dicts[entity_id] = entity_dict
+        return entity_dict
+
+    def location_refs_of(self, object_id):
+        """Locations referenced by the flow fragments containing the object, nearest container first."""
+        # Climb to the first container already resolved, then resolve the chain on the way back down
+        chain = []
+        seen = set()
+        current_id = object_id
+        while current_id is not None and current_id not in self.object_location_refs and current_id not in seen:
+            seen.add(current_id)
+            chain.append(current_id)
+            current_id = self.parents.get(current_id)
+        inherited = self.object_location_refs.get(current_id, [])
+        for chain_id in reversed(chain):
+            own_refs = [loc_id for loc_id in self.flow_fragment_location_refs.get(chain_id, []) if loc_id not in inherited]
+            inherited = own_refs + inherited if own_refs else inherited
+            self.object_location_refs[chain_id] = inherited
+        return self.object_location_refs.get(object_id, inherited)
+
+    def find_related_locations(self, object_ids):
+        """IDs of the known locations referenced by the containers of the given objects, in first-seen order."""
+        location_ids = {}
+        for object_id in object_ids:
+            for loc_id in self.location_refs_of(object_id):
+                if loc_id in self.locations:
+                    location_ids[loc_id] = None
+        return list(location_ids)
+
+    def get_location_dict(self, location_id):
+        location = self.locations[location_id]
+        return {'Id': location.Id, 'Name': location.Name, 'Data': location.Data}
+
+    def get_connection_graph(self):
+        """Return the connections of the current model, stored as integer-indexed arrays."""
+        return self.connection_graph
+
+    def get_dialogue_graph(self):
+        """Return the reachability/loop analysis of the current model, computed once per parse."""
+        if self.dialogue_graph is None:
+            self.dialogue_graph = DialogueGraph(self)
+        return self.dialogue_graph
 
     def load_xml(self):
         try:
@@ -48,37 +447,127 @@ class AlteirXMLParser:
             logging.error(f"Unexpected error loading XML file: {e}")
             sys.exit(1)
 
-    def extract_entities(self):
-        logging.info("Extracting entities (actors)...")
-        for entity_elem in self.root.findall('.//ns:Entity', self.namespace):
-            entity_id = entity_elem.get('Id')
+    def element_handlers(self):
+        """Map the namespaced tag of each extracted object type to its handler."""
+        ns = self.namespace['ns']
+        return {
+            f'{{{ns}}}Entity': self.handle_entity,
+            f'{{{ns}}}Location': self.handle_location,
+            f'{{{ns}}}FlowFragment': self.handle_flow_fragment,
+            f'{{{ns}}}Dialogue': self.handle_dialogue,
+            f'{{{ns}}}DialogueFragment': self.handle_fragment,
+            f'{{{ns}}}Connection': self.handle_connection,
+        }
+
+    def stream_xml(self, source=None):
+        """
+        Parse the XML file, or the file-like source given, in a single forward pass with iterparse.
+        Each object is handed to its handler when its end tag is read, then cleared and detached
+        from its parent, so memory stays flat whatever the size of the export. Hierarchy nodes are
+        recorded as they start and cleared as they end, the Hierarchy section is never held whole.
+        """
+        logging.info(f"Streaming XML file: {self.file_path}")
+        handlers = self.element_handlers()
+        hierarchy_tag = f"{{{self.namespace['ns']}}}Hierarchy"
+        open_objects = 0  # Handled elements still open: their subtree must stay intact until they end
+        open_nodes = None  # Containing object in effect for each open Hierarchy node, None outside the Hierarchy
+        parents = []
+        try:
+            for event, elem in ET.iterparse(source if source is not None else self.file_path, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag in handlers:
+                        open_objects += 1
+                    elif open_nodes is not None:
+                        self.start_hierarchy_node(elem, open_nodes)
+                    elif elem.tag == hierarchy_tag:
+                        open_nodes = []
+                    parents.append(elem)
+                    continue
+
+                parents.pop()
+                handler = handlers.get(elem.tag)
+                if handler is not None:
+                    handler(elem)
+                    open_objects -= 1
+                elif open_nodes is not None:
+                    if open_nodes:
+                        open_nodes.pop()
+                    else:
+                        open_nodes = None
+                if open_objects == 0:
+                    elem.clear()
+                    if parents:
+                        parents[-1].remove(elem)
+        except ET.ParseError as e:
+            logging.error(f"XML parsing error: {e}")
+            sys.exit(1)
+        except FileNotFoundError:
+            logging.error(f"XML file not found: {self.file_path}")
+            sys.exit(1)
+        except Exception as e:
+            logging.error(f"Unexpected error streaming XML file: {e}")
+            sys.exit(1)
+
+    def walk_tree(self):
+        """Extract every object in a single walk of the loaded tree, dispatching each element by tag."""
+        logging.info("Extracting entities, locations, flow fragments, dialogues, fragments and connections...")
+        handlers = self.element_handlers()
+        handlers[f"{{{self.namespace['ns']}}}Hierarchy"] = self.handle_hierarchy
+        for elem in self.root.iter():
+            handler = handlers.get(elem.tag)
+            if handler is not None:
+                handler(elem)
+
+    def find_descendants(self, elem, *names):
+        """Collect the descendants of elem with the given local names, in document order, in one walk."""
+        ns = self.namespace['ns']
+        wanted = {f'{{{ns}}}{name}': name for name in names}
+        found = {name: [] for name in names}
+        for child in elem.iter():
+            name = wanted.get(child.tag)
+            if name is not None:
+                found[name].append(child)
+        return found
+
+    def find_localized_string(self, containers, lang):
+        """Return the first LocalizedString child in the given language, like './/X/LocalizedString[@Lang]'."""
+        localized_tag = f"{{{self.namespace['ns']}}}LocalizedString"
+        for container in containers:
+            for child in container:
+                if child.tag == localized_tag and child.get('Lang') == lang:
+                    return child
+        return None
 
-            # Extract only English display name
-            display_name_elem = entity_elem.find('.//ns:DisplayName/ns:LocalizedString[@Lang="en"]', self.namespace)
-            display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Unnamed"
+    def handle_entity(self, entity_elem):
+        entity_id = intern_id(entity_elem.get('Id'))
+        found = self.find_descendants(entity_elem, 'DisplayName', 'Text', 'Feature')
 
-            # Extract only English text
-            text_elem = entity_elem.find('.//ns:Text/ns:LocalizedString[@Lang="en"]', self.namespace)
-            text = text_elem.text.strip() if text_elem is not None and text_elem.text else ""
+        # Extract only English display name
+        display_name_elem = self.find_localized_string(found['DisplayName'], 'en')
+        display_name = intern_id(display_name_elem.text.strip()) if display_name_elem is not None and display_name_elem.text else "Unnamed"
 
-            # Extract features ensuring only English strings are kept
-            features = self.extract_features(entity_elem)
+        # Extract only English text
+        text_elem = self.find_localized_string(found['Text'], 'en')
+        text = text_elem.text.strip() if text_elem is not None and text_elem.text else ""
 
-            # Create the entity object with extracted information
-            entity = Entity(
-                Id=entity_id,
-                DisplayName=display_name,
-                Text=text,
-                Features=features,
-                References=[]  # Adjust if needed
-            )
+        # Extract features ensuring only English strings are kept
+        features = self.extract_features(found['Feature'])
 
-            self.entities[entity_id] = entity
-            logging.debug(f"Found entity: ID={entity_id}, Name={display_name}")
+        # Create the entity object with extracted information
+        entity = Entity(
+            Id=entity_id,
+            DisplayName=display_name,
+            Text=text,
+            Features=features,
+            References=[]  # Adjust if needed
+        )
 
-    def extract_features(self, entity_elem):
+        self.entities[entity_id] = entity
+        logging.debug(f"Found entity: ID={entity_id}, Name={display_name}")
+
+    def extract_features(self, feature_elems):
         features = []
-        for feature_elem in entity_elem.findall('.//ns:Feature', self.namespace):
+        for feature_elem in feature_elems:
             properties = {}
             for prop in feature_elem.findall('.//ns:Properties/ns:*', self.namespace):
                 prop_name = prop.get('Name')
@@ -108,41 +597,124 @@ class AlteirXMLParser:
         else:
             return prop.text.strip() if prop.text else ""
 
-    def extract_locations(self):
-        logging.info("Extracting locations...")
+    def handle_location(self, location_elem):
+        location_id = intern_id(location_elem.get('Id'))
+        display_names = self.find_descendants(location_elem, 'DisplayName')['DisplayName']
+
+        # Attempt to find display name in English
+        display_name_elem = self.find_localized_string(display_names, 'en')
+
+        # Fallback to French if English is not available
+        if display_name_elem is None or not display_name_elem.text.strip():
+            display_name_elem = self.find_localized_string(display_names, 'fr')
+
+        # Use "Sans Nom" if no valid display name is found
+        display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Sans Nom"
 
-        for location_elem in self.root.findall('.//ns:Location', self.namespace):
-            location_id = location_elem.get('Id')
+        # Data is read back from the file on first access, unless the scan missed the element
+        source = self.location_spans.get(location_id)
+        location = Location(
+            Id=location_id,
+            Name=display_name,
+            Source=source,
+            cached_data=xml_to_dict(location_elem, self.namespace) if source is None else None
+        )
+        self.locations[location_id] = location
+        logging.debug(f"Found location: ID={location_id}, Name={display_name}")
 
-            # Attempt to find display name in English
-            display_name_elem = location_elem.find('.//ns:DisplayName/ns:LocalizedString[@Lang="en"]', self.namespace)
+    def handle_flow_fragment(self, flow_fragment_elem):
+        # Location names are resolved in resolve_references, locations may not be read yet
+        fragment_id = intern_id(flow_fragment_elem.get('Id'))
+        location_elems = self.find_descendants(flow_fragment_elem, 'Reference')['Reference']
+        self.flow_fragment_location_refs[fragment_id] = [intern_id(loc_ref.get('IdRef')) for loc_ref in location_elems]
 
-            # Fallback to French if English is not available
-            if display_name_elem is None or not display_name_elem.text.strip():
-                display_name_elem = location_elem.find('.//ns:DisplayName/ns:LocalizedString[@Lang="fr"]',
-                                                       self.namespace)
+    def handle_dialogue(self, dialogue_elem):
+        dialogue_id = intern_id(dialogue_elem.get('Id'))
+        found = self.find_descendants(dialogue_elem, 'DisplayName', 'Text', 'Pin')
+        display_name_elem = self.find_localized_string(found['DisplayName'], 'en')
+        display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Sans Nom"
+        text_elem = self.find_localized_string(found['Text'], 'en')
+        text = text_elem.text.strip() if text_elem is not None and text_elem.text else ""
+        dialogue = Dialogue(
+            Id=dialogue_id,
+            DisplayName=display_name,
+            Text=text,
+            StartingFragments=[]
+        )
+        self.dialogues[dialogue_id] = dialogue
+        # Keep the output pins, the element itself is not available once parsing is done
+        self.dialogue_output_pins[dialogue_id] = [intern_id(pin.get('Id')) for pin in found['Pin'] if pin.get('Semantic') == 'Output']
+        logging.debug(f"Found dialogue: ID={dialogue_id}, DisplayName={display_name}")
 
-            # Use "Sans Nom" if no valid display name is found
-            display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Sans Nom"
+    def handle_fragment(self, fragment_elem):
+        # The speaker name is resolved in resolve_references, the speaker entity may not be read yet
+        fragment_id = intern_id(fragment_elem.get('Id'))
+        found = self.find_descendants(fragment_elem, 'DisplayName', 'Text', 'Speaker')
+        display_name_elem = found['DisplayName'][0] if found['DisplayName'] else None
+        display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Sans Nom"
+        text_elem = self.find_localized_string(found['Text'], 'en')
+        text = text_elem.text.strip() if text_elem is not None and text_elem.text else ""
+        speaker_elem = found['Speaker'][0] if found['Speaker'] else None
+        speaker_ref = intern_id(speaker_elem.get('IdRef')) if speaker_elem is not None else None
+        fragment = Fragment(
+            Id=fragment_id,
+            DisplayName=display_name,
+            Text=text,
+            SpeakerId=speaker_ref,
+            SpeakerName=""
+        )
+        self.fragments[fragment_id] = fragment
+        logging.debug(f"Found fragment: ID={fragment_id}, SpeakerId={speaker_ref}")
 
-            location_dict = xml_to_dict(location_elem, self.namespace)
-            location = Location(
-                Id=location_id,
-                Name=display_name,
-                Data=location_dict
-            )
-            self.locations[location_id] = location
-            logging.debug(f"Found location: ID={location_id}, Name={display_name}")
+    def handle_connection(self, connection_elem):
+        found = self.find_descendants(connection_elem, 'Source', 'Target')
+        source_elem = found['Source'][0] if found['Source'] else None
+        target_elem = found['Target'][0] if found['Target'] else None
+        source_id = intern_id(source_elem.get('IdRef')) if source_elem is not None else None
+        target_id = intern_id(target_elem.get('IdRef')) if target_elem is not None else None
+        connection = Connection(
+            Source=source_id,
+            Target=target_id,
+            Id=intern_id(connection_elem.get('Id')),
+            SourcePin=intern_id(source_elem.get('PinRef')) if source_elem is not None else None,
+            TargetPin=intern_id(target_elem.get('PinRef')) if target_elem is not None else None
+        )
+        self.parsed_connections.append(connection)
+        logging.debug(f"Found connection: Source={source_id}, Target={target_id}")
 
-    def extract_flow_fragments(self):
+    def handle_hierarchy(self, hierarchy_elem):
+        # Each node refers to an object by IdRef, the nodes nested in it are the objects it contains
+        stack = [(child, None) for child in reversed(list(hierarchy_elem))]
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = intern_id(node.get('IdRef'))
+            if node_id is not None and parent_id is not None:
+                self.parents[node_id] = parent_id
+            child_parent_id = node_id if node_id is not None else parent_id
+            stack.extend((child, child_parent_id) for child in reversed(list(node)))
+        logging.debug(f"Found hierarchy with {len(self.parents)} parent links")
+
+    def start_hierarchy_node(self, node_elem, open_nodes):
+        """Record the containing object of a Hierarchy node read by stream_xml, when its start tag is read."""
+        parent_id = open_nodes[-1] if open_nodes else None
+        node_id = intern_id(node_elem.get('IdRef'))
+        if node_id is not None and parent_id is not None:
+            self.parents[node_id] = parent_id
+        open_nodes.append(node_id if node_id is not None else parent_id)
+
+    def resolve_references(self):
+        """Resolve the names that depend on objects which may appear later in the export."""
+        self.resolve_flow_fragment_locations()
+        logging.info("Resolving fragment speakers...")
+        for fragment in self.fragments.values():
+            self.resolve_speaker(fragment)
+
+    def resolve_flow_fragment_locations(self):
         logging.info("Associating flow fragments to locations...")
-        for flow_fragment_elem in self.root.findall('.//ns:FlowFragment', self.namespace):
-            fragment_id = flow_fragment_elem.get('Id')
-            location_elems = flow_fragment_elem.findall('.//ns:Reference', self.namespace)
+        self.flow_fragments = {}
+        for fragment_id, location_ids in self.flow_fragment_location_refs.items():
             associated_locations = []
-            for loc_ref in location_elems:
-                loc_id = loc_ref.get('IdRef')
-                # Fix: Access the 'Name' attribute of the Location object
+            for loc_id in location_ids:
                 if loc_id in self.locations:
                     loc_name = self.locations[loc_id].Name
                 else:
@@ -152,88 +724,56 @@ class AlteirXMLParser:
             self.flow_fragments[fragment_id] = associated_locations if associated_locations else ["Unknown"]
             logging.debug(f"FlowFragment ID={fragment_id} associated with locations: {self.flow_fragments[fragment_id]}")
 
-    def extract_dialogues(self):
-        logging.info("Extracting dialogues...")
-        for dialogue_elem in self.root.findall('.//ns:Dialogue', self.namespace):
-            dialogue_id = dialogue_elem.get('Id')
-            display_name_elem = dialogue_elem.find('.//ns:DisplayName/ns:LocalizedString[@Lang="en"]', self.namespace)
-            display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Sans Nom"
-            text_elem = dialogue_elem.find('.//ns:Text/ns:LocalizedString[@Lang="en"]', self.namespace)
-            text = text_elem.text.strip() if text_elem is not None and text_elem.text else ""
-            dialogue = Dialogue(
-                Id=dialogue_id,
-                DisplayName=display_name,
-                Text=text,
-                StartingFragments=[]
-            )
-            self.dialogues[dialogue_id] = dialogue
-            logging.debug(f"Found dialogue: ID={dialogue_id}, DisplayName={display_name}")
-
-    def extract_fragments(self):
-        logging.info("Extracting dialogue fragments...")
-        for fragment_elem in self.root.findall('.//ns:DialogueFragment', self.namespace):
-            fragment_id = fragment_elem.get('Id')
-            display_name_elem = fragment_elem.find('.//ns:DisplayName', self.namespace)
-            display_name = display_name_elem.text.strip() if display_name_elem is not None and display_name_elem.text else "Sans Nom"
-            text_elem = fragment_elem.find('.//ns:Text/ns:LocalizedString[@Lang="en"]', self.namespace)
-            text = text_elem.text.strip() if text_elem is not None and text_elem.text else ""
-            speaker_elem = fragment_elem.find('.//ns:Speaker', self.namespace)
-            speaker_ref = speaker_elem.get('IdRef') if speaker_elem is not None else None
-            if speaker_ref and speaker_ref in self.entities:
-                speaker_name = self.entities[speaker_ref].DisplayName
-                logging.debug(f"Found speaker for Fragment ID={fragment_id}: {speaker_name}")
-            else:
-                speaker_name = extract_speaker_from_displayname(display_name)
-                logging.debug(f"Speaker extracted from DisplayName for Fragment ID={fragment_id}: {speaker_name}")
-            fragment = Fragment(
-                Id=fragment_id,
-                DisplayName=display_name,
-                Text=text,
-                SpeakerId=speaker_ref,
-                SpeakerName=speaker_name
-            )
-            self.fragments[fragment_id] = fragment
-            logging.debug(f"Found fragment: ID={fragment_id}, Speaker={speaker_name}")
-
-    def extract_connections(self):
-        logging.info("Extracting connections...")
-        for connection_elem in self.root.findall('.//ns:Connection', self.namespace):
-            source_elem = connection_elem.find('.//ns:Source', self.namespace)
-            target_elem = connection_elem.find('.//ns:Target', self.namespace)
-            source_id = source_elem.get('IdRef') if source_elem is not None else None
-            target_id = target_elem.get('IdRef') if target_elem is not None else None
-            connection = Connection(
-                Source=source_id,
-                Target=target_id
-            )
-            self.connections.append(connection)
-            logging.debug(f"Found connection: Source={source_id}, Target={target_id}")
-
-    def build_source_to_targets(self):
-        for conn in self.connections:
-            self.source_to_targets[conn.Source].append(conn.Target)
-
-    def identify_starting_fragments(self):
+    def resolve_speaker(self, fragment):
+        speaker_ref = fragment.SpeakerId
+        if speaker_ref and speaker_ref in self.entities:
+            fragment.SpeakerName = self.entities[speaker_ref].DisplayName
+            logging.debug(f"Found speaker for Fragment ID={fragment.Id}: {fragment.SpeakerName}")
+        else:
+            fragment.SpeakerName = intern_id(extract_speaker_from_displayname(fragment.DisplayName))
+            logging.debug(f"Speaker extracted from DisplayName for Fragment ID={fragment.Id}: {fragment.SpeakerName}")
+
+    def identify_starting_fragments(self, dialogue_ids=None):
+        # Output pins were captured when the dialogues were parsed, connections leaving them are
+        # looked up in the connection graph instead of scanning every connection for every pin
         logging.info("Identifying starting fragments for each dialogue...")
-        for dialogue_id, dialogue in self.dialogues.items():
-            dialogue_elem = self.root.find(f".//ns:Dialogue[@Id='{dialogue_id}']", self.namespace)
-            if dialogue_elem is None:
+        if dialogue_ids is None:
+            dialogue_ids = list(self.dialogues)
+        for dialogue_id in dialogue_ids:
+            dialogue = self.dialogues[dialogue_id]
+            dialogue.StartingFragments = []
+            output_pins = self.dialogue_output_pins.get(dialogue_id)
+            if output_pins is None:
                 logging.warning(f"Dialogue element not found for ID={dialogue_id}")
                 continue
-            pins = dialogue_elem.findall('.//ns:Pin', self.namespace)
-            output_pins = [pin for pin in pins if pin.get('Semantic') == 'Output']
-            for pin in output_pins:
-                pin_id = pin.get('Id')
-                for conn in self.connections:
-                    if conn.Source == pin_id:
-                        target_fragment_id = conn.Target
-                        if target_fragment_id in self.fragments:
-                            dialogue.StartingFragments.append(target_fragment_id)
-                            logging.debug(f"Dialogue ID={dialogue_id} has starting fragment ID={target_fragment_id}")
-                        else:
-                            logging.warning(f"Target fragment {target_fragment_id} not found for Dialogue ID={dialogue_id}")
-
-def parse_alteir_xml(file_path):
+            for pin_id in output_pins:
+                for target_fragment_id in self.connection_graph.targets(pin_id):
+                    if target_fragment_id in self.fragments:
+                        dialogue.StartingFragments.append(target_fragment_id)
+                        logging.debug(f"Dialogue ID={dialogue_id} has starting fragment ID={target_fragment_id}")
+                    else:
+                        logging.warning(f"Target fragment {target_fragment_id} not found for Dialogue ID={dialogue_id}")
+
+def parse_alteir_xml(file_path, streaming=True, cache_dir=None):
     parser = AlteirXMLParser(file_path)
-    parser.parse()
+    cache = ParseCache(cache_dir) if cache_dir else None
+    state = cache.load(file_path) if cache else None
+    if state is not None:
+        parser.set_model_state(state)
+    else:
+        parser.parse(streaming=streaming)
+        if cache and parser.file_stamp:
+            cache.save(file_path, parser.get_model_state(), parser.file_stamp)
     return parser  # Return the parser object containing the data
+
+def reload_alteir_xml(parser, streaming=True, cache_dir=None):
+    """Incrementally reload the parser's XML file and refresh the parse cache, returns the ParseDelta."""
+    # Only the version the parser read tells whether it is current, the shared cache may hold a newer one
+    if stamp_matches(parser.file_path, parser.file_stamp):
+        logging.info("XML file unchanged since it was parsed, nothing to reload.")
+        return ParseDelta()
+    delta = parser.reload(streaming=streaming)
+    cache = ParseCache(cache_dir) if cache_dir else None
+    if cache and parser.file_stamp:
+        cache.save(parser.file_path, parser.get_model_state(), parser.file_stamp)
+    return delta
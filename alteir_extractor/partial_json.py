@@ -0,0 +1,130 @@
+# partial_json.py
+import json
+import re
+
+NUMBER_OR_LITERAL_PATTERN = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null')
+DELIMITER_PATTERN = re.compile(r'[\s,\]}]')
+WHITESPACE = ' \t\n\r'
+
+
+class IncompleteValue(Exception):
+    """The text ends before a value that cannot be shown partially, such as a number or an object key."""
+
+
+class PartialJSONParser:
+    """
+    Parses a JSON document that may be cut anywhere, as while a response is streamed.
+    A string cut in the middle gives the text received so far, a cut array or object gives the items
+    or members complete enough to be shown. Numbers, literals and keys are only kept once complete.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.index = 0
+
+    def skip_whitespace(self):
+        while self.index < len(self.text) and self.text[self.index] in WHITESPACE:
+            self.index += 1
+
+    def at_end(self):
+        self.skip_whitespace()
+        return self.index >= len(self.text)
+
+    def cut(self):
+        """Stop at a value cut by the end of the text, nothing can follow it so the enclosing containers stop too."""
+        self.index = len(self.text)
+
+    def parse_value(self):
+        if self.at_end():
+            raise IncompleteValue()
+        char = self.text[self.index]
+        if char == '{':
+            return self.parse_object()
+        if char == '[':
+            return self.parse_array()
+        if char == '"':
+            return self.parse_string()[0]
+        # Numbers and literals end at a delimiter, until one is read more characters may follow
+        end = DELIMITER_PATTERN.search(self.text, self.index)
+        if end is None:
+            raise IncompleteValue()
+        match = NUMBER_OR_LITERAL_PATTERN.match(self.text, self.index)
+        if match is None or match.end() != end.start():
+            raise ValueError(f"Invalid JSON at position {self.index}")
+        self.index = match.end()
+        return json.loads(match.group(0))
+
+    def parse_string(self):
+        """Return the string starting at the current quote and whether its closing quote was read."""
+        start = self.index + 1
+        position = start
+        while position < len(self.text):
+            char = self.text[position]
+            if char == '\\':
+                position += 2
+            elif char == '"':
+                self.index = position + 1
+                return json.loads(self.text[start - 1:self.index]), True
+            else:
+                position += 1
+        self.index = len(self.text)
+        body = self.text[start:]
+        try:
+            return json.loads('"' + body + '"'), False
+        except ValueError:
+            # An escape sequence is cut in the middle, it starts at one of the last backslashes
+            return json.loads('"' + body[:body.rfind('\\', -6)] + '"'), False
+
+    def parse_array(self):
+        items = []
+        self.index += 1
+        while not self.at_end():
+            if self.text[self.index] == ']':
+                self.index += 1
+                return items
+            if items:
+                if self.text[self.index] != ',':
+                    raise ValueError(f"Expected ',' at position {self.index}")
+                self.index += 1
+            try:
+                items.append(self.parse_value())
+            except IncompleteValue:
+                self.cut()
+                break
+        return items
+
+    def parse_object(self):
+        members = {}
+        self.index += 1
+        while not self.at_end():
+            if self.text[self.index] == '}':
+                self.index += 1
+                return members
+            if members:
+                if self.text[self.index] != ',':
+                    raise ValueError(f"Expected ',' at position {self.index}")
+                self.index += 1
+                if self.at_end():
+                    break
+            if self.text[self.index] != '"':
+                raise ValueError(f"Expected a key at position {self.index}")
+            key, complete = self.parse_string()
+            if not complete or self.at_end():
+                break
+            if self.text[self.index] != ':':
+                raise ValueError(f"Expected ':' at position {self.index}")
+            self.index += 1
+            try:
+                members[key] = self.parse_value()
+            except IncompleteValue:
+                self.cut()
+                break
+        return members
+
+
+def parse_partial_json(text):
+    """Best-effort value of a JSON document cut anywhere, None if nothing can be shown yet."""
+    try:
+        return PartialJSONParser(text).parse_value()
+    except IncompleteValue:
+        return None
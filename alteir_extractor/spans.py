@@ -0,0 +1,187 @@
+# spans.py
+import hashlib
+import logging
+import mmap
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+ROOT_TAG_PATTERN = re.compile(rb'<[A-Za-z_][^>]*>')
+NAMESPACE_DECLARATION_PATTERN = re.compile(rb'\sxmlns(?::[\w.-]+)?\s*=\s*("[^"]*"|\'[^\']*\')')
+
+# (file path, local name) -> (size, modification time, spans) of the last scan of a changed file
+rescanned_spans: Dict[Tuple[str, str], Tuple[int, int, Dict[str, 'ElementSpan']]] = {}
+rescan_lock = threading.Lock()
+
+
+def span_digest(content: bytes) -> bytes:
+    return hashlib.blake2b(content, digest_size=8).digest()
+
+
+@dataclass(frozen=True, slots=True)
+class ElementSpan:
+    """
+    Location of an element in the raw bytes of an XML file, with the digest of those bytes.
+    Spans compare on the digest only, the same element moved elsewhere in the file is still equal.
+    namespaces holds the namespace declarations of the root element, shared by every span of the file.
+    """
+    file_path: str = field(compare=False)
+    start: int = field(compare=False)
+    end: int = field(compare=False)
+    digest: bytes
+    namespaces: bytes = field(default=b'', compare=False, repr=False)
+
+    def read(self) -> Optional[bytes]:
+        """Raw bytes of the element, None if the file changed since the span was recorded."""
+        try:
+            with open(self.file_path, 'rb') as f:
+                f.seek(self.start)
+                content = f.read(self.end - self.start)
+        except OSError as e:
+            logging.warning(f"Could not read {self.file_path}: {e}")
+            return None
+        return content if span_digest(content) == self.digest else None
+
+    def parse(self, element_id: str, local_name: str) -> Optional[ET.Element]:
+        """Parse the element back from the file, None if it can no longer be found there."""
+        content = self.read()
+        span = self
+        if content is None:
+            # The file changed since it was parsed: look for the element again by Id
+            span = rescan_element_spans(self.file_path, local_name).get(element_id)
+            content = span.read() if span is not None else None
+            if content is None:
+                return None
+        # The element may use prefixes declared on the root, parse it inside a copy of those declarations
+        wrapper = ET.fromstring(b'<SpanRoot' + span.namespaces + b'>' + content + b'</SpanRoot>')
+        return wrapper[0]
+
+
+def rescan_element_spans(file_path: str, local_name: str) -> Dict[str, ElementSpan]:
+    """
+    Spans of a file that changed since it was parsed. The file is scanned once per version, told apart by
+    its size and modification time, and the result serves every element read from it until it changes again.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        logging.warning(f"Could not read {file_path}: {e}")
+        return {}
+    key = (file_path, local_name)
+    with rescan_lock:
+        cached = rescanned_spans.get(key)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        logging.warning(f"{file_path} changed since it was parsed, reload it to refresh the model")
+        spans = scan_elements(file_path, (local_name,))[local_name].spans()
+        rescanned_spans[key] = (stat.st_size, stat.st_mtime_ns, spans)
+        return spans
+
+
+class ScannedElements:
+    """
+    The elements with one local name found by scan_elements, in document order: the Id of each (None
+    without one), its byte span and digest. Digests are kept as the integer they spell, so they fit in an array.
+    """
+
+    def __init__(self, file_path: str, namespaces: bytes = b''):
+        self.file_path = file_path
+        self.namespaces = namespaces
+        self.ids: List[Optional[str]] = []
+        self.digests = array('Q')
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def span(self, index) -> ElementSpan:
+        digest = self.digests[index].to_bytes(8, 'little')
+        return ElementSpan(self.file_path, self.starts[index], self.ends[index], digest, self.namespaces)
+
+    def spans(self) -> Dict[str, ElementSpan]:
+        """Span of each element by Id, elements without an Id are left out."""
+        return {element_id: self.span(index) for index, element_id in enumerate(self.ids) if element_id is not None}
+
+
+def element_pattern(local_names: Iterable[str]) -> re.Pattern:
+    """
+    Match a whole element with one of the local names: group 1 is its tag, group 2 its local name and
+    group 3 or 4 its Id. The element ends at the first end tag with the same name, elements nested in one
+    of the same name are not told apart.
+    """
+    names = b'|'.join(re.escape(name.encode('utf-8')) for name in local_names)
+    return re.compile(
+        rb'<((?:[\w.-]+:)?(' + names + rb'))(?=[\s/>])'
+        rb'(?:(?=[^>]*\sId\s*=\s*(?:"([^"]*)"|\'([^\']*)\'))|)'
+        rb'[^>]*?(?:/>|>[^<]*(?:<(?!/\1\s*>)[^<]*)*</\1\s*>)',
+        re.S
+    )
+
+
+def scan_elements(file_path: str, local_names: Iterable[str]) -> Dict[str, ScannedElements]:
+    """
+    Find the elements with the given local names in the raw bytes of an XML file, in one pass.
+    The scan only matches tags, much faster than parsing: it serves to read elements later, if ever,
+    and to tell which elements changed between two versions of a file without parsing either.
+    """
+    local_names = tuple(local_names)
+    with open(file_path, 'rb') as f:
+        if not f.seek(0, 2):
+            return {name: ScannedElements(file_path) for name in local_names}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            root_tag = ROOT_TAG_PATTERN.search(data)
+            namespaces = b''.join(match.group(0) for match in NAMESPACE_DECLARATION_PATTERN.finditer(root_tag.group(0))) \
+                if root_tag else b''
+            scanned = {name: ScannedElements(file_path, namespaces) for name in local_names}
+            by_local_name = {name.encode('utf-8'): elements for name, elements in scanned.items()}
+            for match in element_pattern(local_names).finditer(data):
+                content, local_name, element_id, other_element_id = match.group(0, 2, 3, 4)
+                if element_id is None:
+                    element_id = other_element_id
+                start, end = match.span()
+                elements = by_local_name[local_name]
+                elements.ids.append(element_id.decode('utf-8') if element_id is not None else None)
+                elements.digests.append(int.from_bytes(span_digest(content), 'little'))
+                elements.starts.append(start)
+                elements.ends.append(end)
+    return scanned
+
+
+class SpanReader:
+    """
+    File-like object over some element spans of a file, read one after the other inside a root element
+    declaring the file's namespaces, so that iterparse streams them like a document of their own.
+    Each span is checked against its digest: reading stops at the first one that no longer matches,
+    stale then tells that the file changed under the reader.
+    """
+
+    CHUNK_SIZE = 1 << 16  # Large elements such as the Hierarchy are handed over in pieces, so they stream
+
+    def __init__(self, file_path: str, spans: List[ElementSpan]):
+        self.stale = False
+        self.chunks = self.read_chunks(file_path, spans)
+
+    def read_chunks(self, file_path, spans) -> Iterator[bytes]:
+        yield b'<SpanRoot' + (spans[0].namespaces if spans else b'') + b'>'
+        try:
+            with open(file_path, 'rb') as f:
+                for span in spans:
+                    f.seek(span.start)
+                    content = f.read(span.end - span.start)
+                    if span_digest(content) != span.digest:
+                        self.stale = True
+                        break
+                    for offset in range(0, len(content), self.CHUNK_SIZE):
+                        yield content[offset:offset + self.CHUNK_SIZE]
+        except OSError as e:
+            logging.warning(f"Could not read {file_path}: {e}")
+            self.stale = True
+        yield b'</SpanRoot>'
+
+    def read(self, size: int = -1) -> bytes:
+        return next(self.chunks, b'')
@@ -0,0 +1,91 @@
+# templates.py
+import hashlib
+import logging
+import os
+import string
+import threading
+import time
+from typing import Dict, FrozenSet, Optional
+
+# Template name -> file, relative to the templates directory
+DEFAULT_TEMPLATE_FILES = {
+    'continuation': 'instruction.txt',
+    'alternatives': 'instruction_alternatives.txt',
+}
+
+
+class InstructionTemplate:
+    """
+    The text of an instruction file, with its $placeholders found once when it is loaded.
+    hash is the SHA-256 of the text, stable across runs, for caches keyed on the instructions.
+    """
+
+    def __init__(self, name: str, file_path: str, text: str, mtime_ns: int, size: int):
+        self.name = name
+        self.file_path = file_path
+        self.text = text
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.template = string.Template(text)
+        self.placeholders: FrozenSet[str] = frozenset(self.template.get_identifiers())
+
+    def render(self, **values) -> str:
+        """Fill the placeholders given in values, the others are left as they are."""
+        if not self.placeholders:
+            return self.text
+        return self.template.safe_substitute({name: value for name, value in values.items() if name in self.placeholders})
+
+
+class InstructionTemplates:
+    """
+    Registry of the named instruction templates, read from base_dir rather than the working directory.
+    A template is read on first use and kept. It is read again when its file's modification time or size
+    changes, checked at most every check_interval seconds, so edits show up without restarting.
+    """
+
+    def __init__(self, base_dir: str, template_files: Optional[Dict[str, str]] = None, check_interval: float = 1.0):
+        self.base_dir = base_dir
+        self.template_files = dict(template_files or DEFAULT_TEMPLATE_FILES)
+        self.check_interval = check_interval
+        self.templates: Dict[str, InstructionTemplate] = {}
+        self.last_checked: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def register(self, name: str, file_name: str):
+        """Add or replace a named template, file_name being relative to base_dir unless absolute."""
+        with self.lock:
+            self.template_files[name] = file_name
+            self.templates.pop(name, None)
+
+    def names(self):
+        return list(self.template_files)
+
+    def __contains__(self, name):
+        return name in self.template_files
+
+    def file_path(self, name: str) -> str:
+        return os.path.join(self.base_dir, self.template_files[name])
+
+    def get(self, name: str) -> InstructionTemplate:
+        if name not in self.template_files:
+            raise ValueError(f"Unknown instruction template '{name}', expected one of {self.names()}")
+        with self.lock:
+            template = self.templates.get(name)
+            now = time.monotonic()
+            if template is not None and now - self.last_checked.get(name, 0.0) < self.check_interval:
+                return template
+            self.last_checked[name] = now
+            file_path = self.file_path(name)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                raise ValueError(f"Instruction file '{file_path}' not found.")
+            if template is None or template.mtime_ns != stat.st_mtime_ns or template.size != stat.st_size:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    text = file.read().strip()
+                if template is not None:
+                    logging.info(f"Instruction template '{name}' changed, reloaded from {file_path}")
+                template = InstructionTemplate(name, file_path, text, stat.st_mtime_ns, stat.st_size)
+                self.templates[name] = template
+            return template
@@ -1,4 +1,13 @@
 # utils.py
+import sys
+
+def intern_id(value):
+    """
+    Intern an Articy ID or other string repeated across many objects, so every occurrence shares one object.
+    None is returned unchanged.
+    """
+    return sys.intern(value) if value is not None else None
+
 def extract_speaker_from_displayname(display_name):
     """
     Extract the speaker's name from the DisplayName if SpeakerId is absent or invalid.
@@ -0,0 +1,130 @@
+# writer.py
+import json
+import logging
+import os
+import tempfile
+
+EXPORT_FORMATS = ('pretty', 'compact', 'jsonl')
+
+
+class ExportWriter:
+    """
+    Writes an export incrementally, dialogue entries message by message, then the other sections.
+    'pretty' and 'compact' produce the same document as json.dump of the whole export, indented by 4
+    or without any whitespace. 'jsonl' writes one record per line, each with a "Type" field.
+    Everything goes to a temporary file next to output_file, which only replaces it once the export
+    is complete. Use as a context manager.
+    """
+
+    def __init__(self, output_file, export_format='pretty'):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}', expected one of {EXPORT_FORMATS}")
+        self.output_file = output_file
+        self.export_format = export_format
+        self.file = None
+        self.temp_file = None
+        self.dialogue_count = 0
+        self.in_dialogues = False
+
+    def __enter__(self):
+        output_dir = os.path.dirname(os.path.abspath(self.output_file))
+        fd, self.temp_file = tempfile.mkstemp(dir=output_dir, prefix=os.path.basename(self.output_file) + '.',
+                                              suffix='.tmp')
+        self.file = os.fdopen(fd, 'w', encoding='utf-8')
+        if self.export_format != 'jsonl':
+            self.file.write('{')
+            self.start_dialogues()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                if self.export_format != 'jsonl':
+                    self.end_dialogues()
+                    self.file.write(self.newline(0) + '}')
+                self.file.close()
+                os.chmod(self.temp_file, 0o644)  # mkstemp creates the file private to the user
+                os.replace(self.temp_file, self.output_file)
+                logging.info(f"Data successfully exported to {self.output_file}")
+            else:
+                self.file.close()
+                os.remove(self.temp_file)
+        except Exception:
+            if os.path.exists(self.temp_file):
+                os.remove(self.temp_file)
+            raise
+        return False
+
+    # Formatting helpers for the JSON document formats
+
+    def newline(self, level):
+        return '\n' + '    ' * level if self.export_format == 'pretty' else ''
+
+    def dump(self, value, level):
+        if self.export_format == 'pretty':
+            return json.dumps(value, ensure_ascii=False, indent=4).replace('\n', self.newline(level))
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+    def key(self, name):
+        return json.dumps(name, ensure_ascii=False) + (': ' if self.export_format == 'pretty' else ':')
+
+    def start_dialogues(self):
+        self.file.write(self.newline(1) + self.key('Dialogues') + '[')
+        self.in_dialogues = True
+
+    def end_dialogues(self):
+        if self.in_dialogues:
+            self.file.write((self.newline(1) if self.dialogue_count else '') + ']')
+            self.in_dialogues = False
+
+    def write_jsonl(self, record_type, record):
+        line = {'Type': record_type}
+        line.update(record if isinstance(record, dict) else {'Value': record})
+        self.file.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    # Public API
+
+    def write_dialogue(self, entry, messages):
+        """Write one dialogue entry: entry holds its fields except Messages, messages may be a generator."""
+        if self.export_format == 'jsonl':
+            dialogue_index = self.dialogue_count
+            self.write_jsonl('Dialogue', entry)
+            for message in messages:
+                self.write_jsonl('Message', {'Dialogue': dialogue_index, **message})
+            self.dialogue_count += 1
+            return
+
+        if not self.in_dialogues:
+            raise ValueError("Dialogues must be written before the other sections.")
+        self.file.write((',' if self.dialogue_count else '') + self.newline(2) + '{')
+        for name, value in entry.items():
+            self.file.write(self.newline(3) + self.key(name) + self.dump(value, 3) + ',')
+        self.file.write(self.newline(3) + self.key('Messages') + '[')
+        message_count = 0
+        for message in messages:
+            self.file.write((',' if message_count else '') + self.newline(4) + self.dump(message, 4))
+            message_count += 1
+        self.file.write((self.newline(3) if message_count else '') + ']' + self.newline(2) + '}')
+        self.dialogue_count += 1
+
+    def write_section(self, name, value):
+        """Write a top-level section such as Characters or Locations, after all the dialogues."""
+        if self.export_format == 'jsonl':
+            items = value.values() if isinstance(value, dict) else value
+            for item in items:
+                self.write_jsonl(name, item)
+            return
+
+        self.end_dialogues()
+        self.file.write(',' + self.newline(1) + self.key(name) + self.dump(value, 1))
+
+
+def write_export(export_data, output_file, export_format='pretty'):
+    """Write an in-memory export (Dialogues first, then the other sections) through an ExportWriter."""
+    with ExportWriter(output_file, export_format) as writer:
+        for dialogue in export_data.get('Dialogues', []):
+            entry = {name: value for name, value in dialogue.items() if name != 'Messages'}
+            writer.write_dialogue(entry, dialogue.get('Messages', []))
+        for name, value in export_data.items():
+            if name != 'Dialogues':
+                writer.write_section(name, value)
@@ -1,4 +1,33 @@
 # config.py
+import os
+
 DEFAULT_XML_PATH = r"F:\Unity\Alteir\Alteir\Assets\Dialogs\Alteir.xml"
 OUTPUT_JSON_FILE = "dialogues_exported.json"
+BATCH_OUTPUT_JSON_FILE = "all_dialogues_exported.json"
+BATCH_EXPORT_FORMAT = "compact"  # pretty, compact or jsonl
 GENERATED_DIALOGUE_FILE = "./NewDialogue.txt"
+PARSE_CACHE_DIR = "./.cache"
+EXPORT_ALL_LOCATIONS = False  # True attaches every location of the project to each extraction
+OPENAI_BASE_URL = None  # Another OpenAI-compatible endpoint, such as a local mock server
+GENERATION_BACKEND = "openai"  # "mock" answers offline with simulated responses, see MOCK_BACKEND_OPTIONS
+MOCK_BACKEND_OPTIONS = {  # Arguments of MockBackend, used with GENERATION_BACKEND = "mock"
+    'latency': 1.0,  # Seconds before a response starts
+    'latency_jitter': 0.5,
+    'chunk_size': 16,  # Characters per streamed chunk
+    'chunk_interval': 0.02,  # Seconds between streamed chunks
+    'error_rate': 0.0,  # Share of the requests that fail
+    'seed': None,  # Set to replay the same sequence of responses
+}
+GENERATION_MAX_CONCURRENCY = 4  # Generation requests running at the same time
+GENERATION_TIMEOUT = 120  # Seconds before a generation request is given up
+GENERATION_REQUESTS_PER_MINUTE = 60  # Spacing of the generation requests, None for no limit
+GENERATION_STREAMING = True  # Show the generated texts progressively while the response is streamed
+GENERATION_CACHE_DIR = "./.cache/generations"
+GENERATION_CACHE_MAX_ENTRIES = 200  # Least recently used generations are removed beyond this
+BATCH_GENERATION_FILE = "./batch_generations.json"
+CONTEXT_TOKEN_BUDGET = 8000  # Tokens of characters and dialogues sent with each generation request
+INSTRUCTION_DIR = os.path.dirname(os.path.abspath(__file__))  # Instruction files are next to this file
+INSTRUCTION_TEMPLATES = {  # Generation option -> instruction file
+    'continuation': 'instruction.txt',
+    'alternatives': 'instruction_alternatives.txt',
+}
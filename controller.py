@@ -1,3 +1,5 @@
+import asyncio
+import concurrent.futures
 import threading
 import logging
 import os
@@ -7,9 +9,15 @@ import winsound
 import time
 import pprint
 
-from alteir_extractor.parser import parse_alteir_xml
-from alteir_extractor.extractor import DialogueFlowExtractor, save_to_json
-from alteir_extractor.generator import DialogueGenerator
+import config
+from alteir_extractor.parser import parse_alteir_xml, reload_alteir_xml
+from alteir_extractor.extractor import DialogueFlowExtractor, FlowCache, save_to_json
+from alteir_extractor.generator import DialogueGenerator, GenerationCache
+from alteir_extractor.context import PromptContext
+from alteir_extractor.templates import InstructionTemplates
+from alteir_extractor.engine import GenerationEngine
+from alteir_extractor.backends import MockBackend, OpenAIBackend
+from alteir_extractor.batch import export_all_dialogues
 
 
 class AlteirController:
@@ -18,6 +26,12 @@ class AlteirController:
         self.parser = None
         self.selected_id = None
         self.selected_dialogue = None
+        self.flow_cache = FlowCache()
+        self.generation_engine = None  # Created with its backend by get_generation_engine
+        self.api_key = None
+        self.prompt_context = None  # Cleaned data of the last extraction, see PromptContext
+        self.instruction_templates = InstructionTemplates(config.INSTRUCTION_DIR, config.INSTRUCTION_TEMPLATES)
+        self.generation_cache = GenerationCache(config.GENERATION_CACHE_DIR, config.GENERATION_CACHE_MAX_ENTRIES)
 
     def load_xml(self):
         xml_file = self.gui.get_xml_file_path()
@@ -28,7 +42,14 @@ class AlteirController:
             self.gui.display_error("Error", f"The file {xml_file} does not exist.")
             return
         try:
-            self.parser = parse_alteir_xml(xml_file)
+            if self.parser is not None and os.path.abspath(self.parser.file_path) == os.path.abspath(xml_file):
+                # Same export as before: only patch what changed since the last load
+                delta = reload_alteir_xml(self.parser, cache_dir=config.PARSE_CACHE_DIR)
+                self.populate_listbox()
+                logging.info(f"XML file reloaded: {delta.summary()}")
+                self.gui.display_message("XML Reloaded", delta.summary())
+                return
+            self.parser = parse_alteir_xml(xml_file, cache_dir=config.PARSE_CACHE_DIR)
             self.populate_listbox()
             logging.info("XML file loaded successfully.")
         except Exception as e:
@@ -93,6 +114,26 @@ class AlteirController:
             logging.error(f"An error occurred during extraction: {e}")
             self.gui.display_error("Extraction Error", str(e))
 
+    def extract_all(self, output_file):
+        logging.info("Batch extraction of all dialogues requested.")
+        if not self.parser:
+            self.gui.display_error("Error", "Please load an XML file first.")
+            return
+        threading.Thread(target=self.run_batch_extraction, args=(output_file,)).start()
+
+    def run_batch_extraction(self, output_file):
+        try:
+            dialogue_count = export_all_dialogues(
+                self.parser, output_file, export_format=config.BATCH_EXPORT_FORMAT
+            )
+            self.validate_output_file(output_file)
+            winsound.MessageBeep()
+            self.gui.display_message("Batch Extraction", f"{dialogue_count} dialogue flows exported to {output_file}")
+        except OSError as os_error:
+            self.handle_extraction_error(output_file, os_error, "OS")
+        except Exception as e:
+            self.handle_extraction_error(output_file, e, "unexpected")
+
     def run_extraction(self, output_file):
         try:
             logging.info(f"Starting extraction for selected ID: {self.selected_id}")
@@ -105,6 +146,9 @@ class AlteirController:
 
             self.save_extracted_data_to_file(extracted_data, output_file)
 
+            # Cleaned once here, the dropdown and the generations use it without reading the file back
+            self.prompt_context = PromptContext.from_export(extracted_data)
+
             self.validate_output_file(output_file)
 
             self.confirm_extraction_completion()
@@ -118,7 +162,7 @@ class AlteirController:
 
     def extract_dialogue_or_fragment(self):
         # Initialize the DialogueFlowExtractor
-        flow_extractor = DialogueFlowExtractor(self.parser)
+        flow_extractor = DialogueFlowExtractor(self.parser, self.flow_cache)
 
         # Extract dialogue or fragment based on selected ID
         if self.selected_id in self.parser.dialogues:
@@ -135,9 +179,18 @@ class AlteirController:
         return flow_extractor.export_data
 
     def include_location_data(self, extracted_data):
-        logging.info("Including extracted locations into export data.")
-        locations_data = self.parser.locations  # Assuming locations were previously extracted and stored in parser
-        extracted_data['Locations'] = {loc_id: loc.__dict__ for loc_id, loc in locations_data.items()}
+        if config.EXPORT_ALL_LOCATIONS:
+            logging.info("Including all locations into export data.")
+            location_ids = list(self.parser.locations)
+        else:
+            # Only the locations referenced by the flow fragments containing the extracted objects
+            logging.info("Including the locations related to the extracted flow into export data.")
+            object_ids = []
+            for dialogue in extracted_data['Dialogues']:
+                object_ids.append(dialogue.get('DialogueId', dialogue.get('FragmentId')))
+                object_ids.extend(message['FragmentId'] for message in dialogue['Messages'])
+            location_ids = self.parser.find_related_locations(object_ids)
+        extracted_data['Locations'] = {loc_id: self.parser.get_location_dict(loc_id) for loc_id in location_ids}
 
     def display_extracted_text(self, extracted_data):
         formatted_text = ""
@@ -180,33 +233,37 @@ class AlteirController:
         self.gui.display_error("Error", f"Failed to process {output_file} due to {error_type} error:\n{error}")
 
     def populate_character_dropdown(self):
-        output_file = self.gui.get_output_file_path()
-        if not output_file or not os.path.exists(output_file):
-            logging.error("Output file does not exist.")
+        if self.prompt_context is None:
+            logging.error("No extracted data to take the characters from.")
             return
 
-        try:
-            with open(output_file, 'r', encoding='utf-8') as f:
-                extracted_data = json.load(f)
-
-            characters_data = extracted_data.get('Characters', [])
-            if not characters_data:
-                logging.error("No characters found in the extracted data.")
-                return
+        characters = self.prompt_context.character_names
+        if not characters:
+            logging.error("No characters found in the extracted data.")
+            return
+        logging.info(f"Characters extracted: {characters}")
 
-            characters = [char.get('DisplayName', 'Unnamed') for char in characters_data]
-            logging.info(f"Characters extracted: {characters}")
+        # Update the character dropdown in the main GUI thread
+        self.gui.master.after(0, self.gui.right_frame_ui.update_character_dropdown, characters)
+        self.gui.master.after(0, self.gui.right_frame_ui.enable_generate_buttons)
 
-            # Update the character dropdown in the main GUI thread
-            self.gui.master.after(0, self.gui.right_frame_ui.update_character_dropdown, characters)
-            self.gui.master.after(0, self.gui.right_frame_ui.enable_generate_buttons)
+    def reload_extracted_data(self):
+        """Read the output file again, for an export written or edited outside this session."""
+        output_file = self.gui.get_output_file_path()
+        if not output_file or not os.path.exists(output_file):
+            self.gui.display_error("Error", f"The file {output_file} does not exist.")
+            return
+        try:
+            self.prompt_context = PromptContext.load(output_file)
+            logging.info(f"Extracted data reloaded from {output_file}")
+            self.populate_character_dropdown()
         except Exception as e:
             logging.error(f"Error loading characters from output file: {e}")
             self.gui.display_error("Error", f"Failed to load characters:\n{e}")
 
-    def generate_dialogue(self):
-        output_file = self.gui.get_output_file_path()
-        if not output_file or not os.path.exists(output_file):
+    def generate_dialogue(self, reroll=False):
+        """Generate for the selected character, a reroll bypasses the generation cache."""
+        if self.prompt_context is None:
             self.gui.display_error(
                 "Error", "Please extract dialogue data first to generate the next line."
             )
@@ -224,147 +281,227 @@ class AlteirController:
         # Get the selected model
         selected_model = self.gui.right_frame_ui.get_selected_model()
 
-        threading.Thread(
-            target=self.run_generation,
-            args=(output_file, selected_character, custom_instruction, generation_option, selected_model),
-        ).start()
+        self.run_generation(self.prompt_context, selected_character, custom_instruction, generation_option,
+                            selected_model, use_cache=not reroll)
+
+    def get_generation_engine(self):
+        """Return the engine running the generation requests, created with its backend on first use."""
+        if self.generation_engine is None:
+            backend = self.create_generation_backend()
+            if backend is None:
+                return None
+            self.generation_engine = GenerationEngine(
+                backend, max_concurrency=config.GENERATION_MAX_CONCURRENCY, timeout=config.GENERATION_TIMEOUT,
+                requests_per_minute=config.GENERATION_REQUESTS_PER_MINUTE
+            )
+        return self.generation_engine
+
+    def create_generation_backend(self):
+        """The backend selected by config.GENERATION_BACKEND, the OpenAI one reading the API key."""
+        if config.GENERATION_BACKEND == 'mock':
+            logging.info("Generating with the offline mock backend.")
+            return MockBackend(**config.MOCK_BACKEND_OPTIONS)
+        if config.GENERATION_BACKEND != 'openai':
+            self.gui.display_error("Error", f"Unknown generation backend: {config.GENERATION_BACKEND}")
+            return None
+        # Load the API key from a .txt file
+        try:
+            with open('api_key.txt', 'r', encoding='utf-8') as key_file:
+                api_key = key_file.read().strip()
+        except FileNotFoundError:
+            logging.error("API key file missing. Ensure 'api_key.txt' exists.")
+            self.gui.display_error("Error", "API key file 'api_key.txt' not found.")
+            return None
+        except Exception as e:
+            logging.error(f"Error reading API key: {e}")
+            self.gui.display_error("Error", f"An error occurred while reading the API key:\n{e}")
+            return None
+        self.api_key = api_key
+        return OpenAIBackend(api_key, base_url=config.OPENAI_BASE_URL)
 
-    def run_generation(self, output_file, selected_character, custom_instruction, generation_option, selected_model):
+    def run_generation(self, prompt_context, selected_character, custom_instruction, generation_option,
+                       selected_model, use_cache=True):
         try:
-            with open(output_file, 'r', encoding='utf-8') as f:
-                dialogue_data = json.load(f)
-
-            # Clean the dialogue data
-            cleaned_data = self.clean_dialogue_data(dialogue_data)
-
-            # Load the API key from a .txt file
-            try:
-                with open('api_key.txt', 'r', encoding='utf-8') as key_file:
-                    api_key = key_file.read().strip()
-            except FileNotFoundError:
-                logging.error("API key file missing. Ensure 'api_key.txt' exists.")
-                self.gui.display_error("Error", "API key file 'api_key.txt' not found.")
-                return
-            except Exception as e:
-                logging.error(f"Error reading API key: {e}")
-                self.gui.display_error("Error", f"An error occurred while reading the API key:\n{e}")
+            engine = self.get_generation_engine()
+            if engine is None:
+                self.gui.right_frame_ui.on_dialogue_generated()
                 return
 
-            # Create an instance of DialogueGenerator
-            generator = DialogueGenerator(api_key=api_key)
-
-            # Generate the next dialogue or alternatives using AI
-            generated_output = generator.generate_next_line(
-                cleaned_data, selected_character, custom_instruction, generation_option, selected_model
+            # Create an instance of DialogueGenerator sharing the engine's client
+            generator = DialogueGenerator(
+                api_key=self.api_key, engine=engine, cache=self.generation_cache,
+                context_token_budget=config.CONTEXT_TOKEN_BUDGET, templates=self.instruction_templates
             )
 
-            # Log the raw API output for verification
-            logging.info(f"Raw API output:\n{pprint.pformat(generated_output)}")
+            # Generate the next dialogue or alternatives using AI, without blocking the GUI
+            # When streaming, the texts are filled progressively as the response arrives
+            on_partial = None
+            if config.GENERATION_STREAMING:
+                on_partial = lambda partial_output: self.display_partial_output(partial_output, generation_option)
+            future = engine.submit(generator.generate_next_line_async(
+                prompt_context, selected_character, custom_instruction, generation_option, selected_model,
+                on_partial=on_partial, use_cache=use_cache
+            ))
+            future.add_done_callback(lambda done: self.on_generation_done(done, generation_option))
 
-            # Extract generated dialogues and feedback
-            preparation = generated_output.get(
-                'preparation', 'No preparation content available.'
+        except Exception as e:
+            logging.error(f"Unexpected error during dialogue generation: {e}")
+            self.gui.right_frame_ui.on_dialogue_generated()
+            self.gui.display_error(
+                "Error", f"An error occurred during dialogue generation:\n{e}"
             )
 
-            autocritic_feedback = generated_output.get(
-                'autocritic', generated_output.get('context_comparison', 'No autocritic available.')
+    def on_generation_done(self, future, generation_option):
+        """Called on the engine thread when a generation request is over."""
+        self.gui.master.after(0, self.gui.right_frame_ui.on_dialogue_generated)
+        if future.cancelled():
+            logging.info("Dialogue generation cancelled.")
+            return
+        try:
+            generated_output = future.result()
+        except asyncio.TimeoutError:
+            logging.error("Dialogue generation timed out.")
+            self.gui.display_error("Error", f"Dialogue generation timed out after {config.GENERATION_TIMEOUT} seconds.")
+            return
+        except Exception as e:
+            logging.error(f"Unexpected error during dialogue generation: {e}")
+            self.gui.display_error(
+                "Error", f"An error occurred during dialogue generation:\n{e}"
             )
+            return
+        self.display_generated_output(generated_output, generation_option)
 
-            improvement_advice = generated_output.get(
-                'improvement_advice', generated_output.get('brainstorm', 'No improvement advice available.')
+    def generate_for_all_characters(self, include_alternatives=False):
+        """Generate for every extracted character at once, the results are collected in one review file."""
+        if self.prompt_context is None:
+            self.gui.display_error(
+                "Error", "Please extract dialogue data first to generate the next line."
             )
+            return
+        generation_options = ['continuation', 'alternatives'] if include_alternatives else ['continuation']
+        custom_instruction = self.gui.left_frame_ui.get_custom_instruction()
+        selected_model = self.gui.right_frame_ui.get_selected_model()
+        threading.Thread(
+            target=self.run_batch_generation,
+            args=(self.prompt_context, generation_options, custom_instruction, selected_model,
+                  config.BATCH_GENERATION_FILE),
+        ).start()
 
-            # Combine autocritic and improvement advice
-            combined_feedback = f"Autocritic:\n{autocritic_feedback}\n\nImprovement Advice:\n{improvement_advice}"
-
-            if generation_option == 'continuation':
-                dialogue_1 = generated_output.get(
-                    'dialogue_version_1', 'Dialogue not generated.'
-                )
-                dialogue_2 = generated_output.get(
-                    'dialogue_version_2', 'Dialogue not generated.'
-                )
-            elif generation_option == 'alternatives':
-                dialogue_1 = generated_output.get(
-                    'alternative_1', 'Alternative not generated.'
-                )
-                dialogue_2 = generated_output.get(
-                    'alternative_2', 'Alternative not generated.'
-                )
-            else:
-                logging.error(f"Unknown generation option: {generation_option}")
-                self.gui.display_error("Error", f"Unknown generation option: {generation_option}")
+    def run_batch_generation(self, prompt_context, generation_options, custom_instruction, selected_model,
+                             review_file):
+        try:
+            characters = [character['DisplayName'] for character in prompt_context.cleaned_data['Characters']]
+            if not characters:
+                self.gui.display_error("Error", "No characters found in the extracted data.")
                 return
 
-            self.gui.right_frame_ui.on_dialogue_generated()
-
-            # Update the interface with the generated texts
-            self.gui.master.after(0, self.gui.right_frame_ui.display_preparation_text, preparation)
-            self.gui.master.after(0, self.gui.right_frame_ui.display_generated_dialogue, dialogue_1, dialogue_2)
-            self.gui.master.after(0, self.gui.right_frame_ui.display_autocritic_feedback, combined_feedback)
+            engine = self.get_generation_engine()
+            if engine is None:
+                return
+            generator = DialogueGenerator(
+                api_key=self.api_key, engine=engine, cache=self.generation_cache,
+                context_token_budget=config.CONTEXT_TOKEN_BUDGET, templates=self.instruction_templates
+            )
 
+            # Every request is in flight at once, the engine applies the concurrency and rate limits
+            requests = [(character, option) for character in characters for option in generation_options]
+            logging.info(f"Generating {len(requests)} dialogues for {len(characters)} characters...")
+            futures = [
+                engine.submit(generator.generate_next_line_async(
+                    prompt_context, character, custom_instruction, option, selected_model
+                ))
+                for character, option in requests
+            ]
+            concurrent.futures.wait(futures)
+
+            generations = []
+            failed = 0
+            for (character, option), future in zip(requests, futures):
+                generation = {'Character': character, 'Option': option}
+                if future.cancelled():
+                    generation['Error'] = "Cancelled"
+                elif future.exception() is not None:
+                    generation['Error'] = repr(future.exception())
+                else:
+                    generation['Output'] = future.result()
+                failed += 'Error' in generation
+                generations.append(generation)
+
+            review = {
+                'Model': selected_model,
+                'CustomInstruction': custom_instruction,
+                'Generations': generations
+            }
+            with open(review_file, 'w', encoding='utf-8') as f:
+                json.dump(review, f, ensure_ascii=False, indent=4)
+            logging.info(f"Batch generation saved to {review_file}")
+            winsound.MessageBeep()
+            self.gui.display_message(
+                "Batch Generation",
+                f"{len(generations) - failed} of {len(generations)} dialogues generated, saved to {review_file}"
+            )
         except Exception as e:
-            logging.error(f"Unexpected error during dialogue generation: {e}")
-            self.gui.display_error(
-                "Error", f"An error occurred during dialogue generation:\n{e}"
+            logging.error(f"Unexpected error during batch generation: {e}")
+            self.gui.display_error("Error", f"An error occurred during batch generation:\n{e}")
+        finally:
+            self.gui.master.after(0, self.gui.right_frame_ui.on_dialogue_generated)
+
+    def cancel_generation(self):
+        if self.generation_engine is not None:
+            self.generation_engine.cancel_all()
+
+    def generated_texts(self, generated_output, generation_option, partial=False):
+        """
+        Return the preparation, the two dialogues and the combined feedback of a generation output.
+        A partial output, still being streamed, shows its missing parts as empty instead of placeholders.
+        """
+        def field(name, fallback_name, placeholder):
+            fallback = '' if partial else placeholder
+            return generated_output.get(name, generated_output.get(fallback_name, fallback) if fallback_name else fallback)
+
+        # Extract generated dialogues and feedback
+        preparation = field('preparation', None, 'No preparation content available.')
+        autocritic_feedback = field('autocritic', 'context_comparison', 'No autocritic available.')
+        improvement_advice = field('improvement_advice', 'brainstorm', 'No improvement advice available.')
+
+        # Combine autocritic and improvement advice
+        combined_feedback = f"Autocritic:\n{autocritic_feedback}\n\nImprovement Advice:\n{improvement_advice}"
+
+        if generation_option == 'continuation':
+            dialogue_1 = field('dialogue_version_1', None, 'Dialogue not generated.')
+            dialogue_2 = field('dialogue_version_2', None, 'Dialogue not generated.')
+        elif generation_option == 'alternatives':
+            dialogue_1 = field('alternative_1', None, 'Alternative not generated.')
+            dialogue_2 = field('alternative_2', None, 'Alternative not generated.')
+        else:
+            raise ValueError(f"Unknown generation option: {generation_option}")
+        return preparation, dialogue_1, dialogue_2, combined_feedback
+
+    def display_partial_output(self, partial_output, generation_option):
+        """Called on the engine thread with the output parsed so far while a response is streamed."""
+        try:
+            texts = self.generated_texts(partial_output, generation_option, partial=True)
+        except ValueError:
+            return
+        self.gui.master.after(0, self.gui.right_frame_ui.display_partial_output, *texts)
+
+    def display_generated_output(self, generated_output, generation_option):
+        # Log the raw API output for verification
+        logging.info(f"Raw API output:\n{pprint.pformat(generated_output)}")
+
+        try:
+            preparation, dialogue_1, dialogue_2, combined_feedback = self.generated_texts(
+                generated_output, generation_option
             )
+        except ValueError:
+            logging.error(f"Unknown generation option: {generation_option}")
+            self.gui.display_error("Error", f"Unknown generation option: {generation_option}")
+            return
 
-    def clean_dialogue_data(self, dialogue_data):
-        """Clean the dialogue data by removing unnecessary fields and keeping only English text."""
-        cleaned_data = {}
-
-        # Clean "Dialogues"
-        dialogues = dialogue_data.get('Dialogues', [])
-        cleaned_dialogues = []
-        for dialogue in dialogues:
-            cleaned_dialogue = {}
-            messages = dialogue.get('Messages', [])
-            cleaned_messages = []
-            for message in messages:
-                # Keep only 'Text' and 'SpeakerName'
-                cleaned_message = {
-                    'Text': message.get('Text', ''),
-                    'SpeakerName': message.get('SpeakerName', 'Unnamed')
-                }
-                cleaned_messages.append(cleaned_message)
-            cleaned_dialogue['Messages'] = cleaned_messages
-            cleaned_dialogues.append(cleaned_dialogue)
-        cleaned_data['Dialogues'] = cleaned_dialogues
-
-        # Clean "Characters"
-        characters = dialogue_data.get('Characters', [])
-        cleaned_characters = []
-        for character in characters:
-            cleaned_character = {}
-            cleaned_character['DisplayName'] = character.get('DisplayName', '')
-            cleaned_character['Text'] = character.get('Text', '')
-            # Process Features
-            features = character.get('Features', [])
-            cleaned_features = []
-            for feature in features:
-                properties = feature.get('Properties', {})
-                cleaned_properties = {}
-                for key, value in properties.items():
-                    # If value is a list with both French and English, keep only the English text
-                    if isinstance(value, list):
-                        if len(value) > 1:
-                            # Assume the second item is English
-                            cleaned_value = value[1]
-                        else:
-                            cleaned_value = value[0]
-                        cleaned_properties[key] = cleaned_value
-                    else:
-                        cleaned_properties[key] = value
-                cleaned_features.append({'Properties': cleaned_properties})
-            cleaned_character['Features'] = cleaned_features
-            cleaned_characters.append(cleaned_character)
-        cleaned_data['Characters'] = cleaned_characters
-
-        # Include "Locations" if necessary
-        if 'Locations' in dialogue_data:
-            cleaned_data['Locations'] = dialogue_data['Locations']
-
-        return cleaned_data
+        # Update the interface with the generated texts
+        self.gui.master.after(0, self.gui.right_frame_ui.display_preparation_text, preparation)
+        self.gui.master.after(0, self.gui.right_frame_ui.display_generated_dialogue, dialogue_1, dialogue_2)
+        self.gui.master.after(0, self.gui.right_frame_ui.display_autocritic_feedback, combined_feedback)
 
     def save_dialogue(self):
         generated_file = "./NewDialogue.txt"
@@ -385,4 +522,4 @@ class AlteirController:
             )
 
     def reroll_dialogue(self):
-        self.generate_dialogue()
\ No newline at end of file
+        self.generate_dialogue(reroll=True)
\ No newline at end of file
@@ -69,7 +69,10 @@ class AlteirExtractorGUI:
         self.menu_bar.add_cascade(label="File", menu=file_menu)
 
         file_menu.add_command(label="Set XML File Path", command=self.browse_xml_file)
+        file_menu.add_command(label="Reload XML File", command=self.load_xml)
         file_menu.add_command(label="Set Output JSON File Path", command=self.browse_output_file)
+        file_menu.add_command(label="Reload Extracted Dialogue", command=self.reload_extracted_data)
+        file_menu.add_command(label="Extract All Dialogues...", command=self.extract_all_dialogues)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.master.quit)
 
@@ -117,6 +120,20 @@ class AlteirExtractorGUI:
         if file_path:
             self.output_file_path = file_path
 
+    def extract_all_dialogues(self):
+        """Ask for an output file and export every dialogue using the controller."""
+        logging.info("Browsing for batch output JSON file")
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json", initialfile="all_dialogues_exported.json", filetypes=[("JSON files", "*.json")]
+        )
+        if file_path:
+            self.controller.extract_all(file_path)
+
+    def reload_extracted_data(self):
+        """Read the output JSON file again using the controller."""
+        logging.info("Reloading extracted dialogue")
+        self.controller.reload_extracted_data()
+
     def load_xml(self):
         """Load the XML file using the controller."""
         logging.info("Loading XML file")
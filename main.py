@@ -1,10 +1,35 @@
-import tkinter as tk
-from gui import AlteirExtractorGUI
+import argparse
+import logging
+import os
+
+import config
 
 def main():
+    import tkinter as tk
+    from gui import AlteirExtractorGUI
+
     root = tk.Tk()
     app = AlteirExtractorGUI(root)
     root.mainloop()
 
+def extract_all(xml_file, output_file, workers, export_format):
+    from alteir_extractor.parser import parse_alteir_xml
+    from alteir_extractor.batch import export_all_dialogues
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format='%(levelname)s: %(message)s')
+    parser = parse_alteir_xml(xml_file, cache_dir=config.PARSE_CACHE_DIR)
+    export_all_dialogues(parser, output_file, workers=workers, export_format=export_format)
+
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="Alteir dialogue extractor")
+    arg_parser.add_argument('--extract-all', metavar='OUTPUT_JSON', nargs='?', const=config.BATCH_OUTPUT_JSON_FILE,
+                            help="Export every dialogue of the XML file without starting the GUI")
+    arg_parser.add_argument('--xml', default=config.DEFAULT_XML_PATH, help="Articy XML export to read")
+    arg_parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    arg_parser.add_argument('--format', default=config.BATCH_EXPORT_FORMAT, choices=['pretty', 'compact', 'jsonl'],
+                            help="pretty (indented JSON), compact (unindented JSON) or jsonl (one record per line)")
+    args = arg_parser.parse_args()
+    if args.extract_all:
+        extract_all(args.xml, args.extract_all, args.workers, args.format)
+    else:
+        main()
@@ -112,6 +112,37 @@ class RightFrame:
         )
         self.timer_label.grid(row=2, column=2, padx=5, pady=5, sticky='w')
 
+        # "Cancel" Button, enabled while a generation is running
+        self.cancel_button = ttk.Button(
+            self.generate_frame,
+            text="Cancel",
+            bootstyle="danger",
+            command=self.cancel_generation,
+            state='disabled',
+            style='Custom.TButton'
+        )
+        self.cancel_button.grid(row=2, column=3, padx=5, pady=5, sticky='w')
+
+        # "Generate For All Characters" Button
+        self.generate_all_button = ttk.Button(
+            self.generate_frame,
+            text="Generate For All Characters",
+            bootstyle="info",
+            command=self.handle_generate_all,
+            state='disabled',
+            style='Custom.TButton'
+        )
+        self.generate_all_button.grid(row=3, column=0, padx=5, pady=5, sticky='w')
+
+        # Whether the batch also asks for alternatives
+        self.include_alternatives = tk.BooleanVar(value=False)
+        include_alternatives_check = ttk.Checkbutton(
+            self.generate_frame,
+            text="Include alternatives",
+            variable=self.include_alternatives
+        )
+        include_alternatives_check.grid(row=3, column=1, padx=5, pady=5, sticky='w')
+
         # Context Frame
         self.context_frame = ttk.Frame(self.parent, padding=10, bootstyle="light")
         self.context_frame.grid(row=1, column=0, sticky='nsew', pady=5)
@@ -322,12 +353,21 @@ class RightFrame:
         """Handle actions when generating dialogues."""
         self.generation_option.set(option)
         self.start_timer()  # Start the timer
+        self.cancel_button.config(state='normal')
         self.generate_dialogue()
 
     def enable_generate_buttons(self):
         """Enable the generate buttons."""
         self.continue_button.config(state='normal')
         self.alternatives_button.config(state='normal')
+        self.generate_all_button.config(state='normal')
+
+    def handle_generate_all(self):
+        """Generate for every character of the extracted dialogue at once."""
+        logging.info("Generating for all characters in RightFrame")
+        self.start_timer()
+        self.cancel_button.config(state='normal')
+        self.main_gui.controller.generate_for_all_characters(self.include_alternatives.get())
 
     def update_character_dropdown(self, characters):
         """Update the character dropdown with a list of names."""
@@ -359,6 +399,12 @@ class RightFrame:
     def on_dialogue_generated(self):
         """Callback method called after dialogue generation."""
         self.stop_timer()
+        self.cancel_button.config(state='disabled')
+
+    def cancel_generation(self):
+        """Cancel the running generation requests."""
+        logging.info("Cancelling dialogue generation")
+        self.main_gui.controller.cancel_generation()
 
     def display_preparation_text(self, text):
         """Display the preparation text in the textbox."""
@@ -389,6 +435,16 @@ class RightFrame:
         else:
             self.preparation_text.config(state='normal')
 
+    def display_partial_output(self, preparation, dialogue_1, dialogue_2, feedback):
+        """Show the texts of a response still being streamed, the save and reroll buttons stay as they are."""
+        text_boxes = [self.preparation_text, self.generated_text_boxes[0], self.autocritic_text,
+                      self.generated_text_boxes[1]]
+        for text_box, text in zip(text_boxes, (preparation, dialogue_1, feedback, dialogue_2)):
+            text_box.config(state='normal')
+            text_box.delete(1.0, tk.END)
+            text_box.insert(tk.END, text)
+            text_box.config(state='disabled')
+
     def save_dialogue(self, dialogue_number):
         """Save the selected dialogue."""
         logging.info(f"Saving Dialogue {dialogue_number}")
@@ -398,7 +454,9 @@ class RightFrame:
     def reroll_dialogue(self):
         """Reroll to generate a new dialogue."""
         logging.info("Rerolling dialogue")
-        self.generate_dialogue()
+        self.start_timer()
+        self.cancel_button.config(state='normal')
+        self.main_gui.controller.reroll_dialogue()
 
     def display_autocritic_feedback(self, feedback):
         """Display the autocritic feedback in the textbox."""
@@ -0,0 +1,64 @@
+import contextlib
+import io
+
+from alteir_extractor.backends import MockBackend
+from alteir_extractor.context import ContextPacker, PromptContext, TokenCounter
+from alteir_extractor.generator import DialogueGenerator
+from alteir_extractor.templates import InstructionTemplates
+
+EXPORT = {
+    'Characters': [
+        {'DisplayName': 'Zed', 'Text': 'A pilot.', 'Features': [{'Properties': {'Mood': ['Sombre', 'Gloomy'], 'Age': 40}}]},
+        {'DisplayName': 'Ann', 'Text': 'An engineer.', 'Features': [{'Properties': {'Role': 'Mechanic'}}]},
+        {'DisplayName': 'Bob', 'Text': 'The captain.', 'Features': []},
+    ],
+    'Dialogues': [
+        {'Messages': [{'Text': 'We leave at dawn.', 'SpeakerName': 'Bob'},
+                      {'Text': 'The engine will not hold.', 'SpeakerName': 'Ann'}]},
+    ],
+}
+
+
+class FixedTokenCounter(TokenCounter):
+    """Counts the same with or without tiktoken installed."""
+
+    def __init__(self):
+        self.encoding = None
+
+
+def make_generator(tmp_path):
+    (tmp_path / 'instruction.txt').write_text('Write the next line.', encoding='utf-8')
+    templates = InstructionTemplates(str(tmp_path), {'continuation': 'instruction.txt'})
+    generator = DialogueGenerator(backend=MockBackend(), templates=templates)
+    generator.context_packer = ContextPacker(8000, counter=FixedTokenCounter())
+    return generator
+
+
+def prepare_messages(generator, prompt_context, character, custom_instruction):
+    with contextlib.redirect_stdout(io.StringIO()):
+        messages, _, _ = generator.prepare_request(prompt_context, character, custom_instruction, 'continuation', 'gpt-4o')
+    return messages
+
+
+def prefix_bytes(messages):
+    """The system and context messages, as the bytes the provider's prompt cache compares."""
+    return [(message['role'], message['content'].encode('utf-8')) for message in messages[:2]]
+
+
+def test_prefix_is_stable_across_rerolls_and_custom_instructions(tmp_path):
+    generator = make_generator(tmp_path)
+    prompt_context = PromptContext.from_export(EXPORT)
+    first = prepare_messages(generator, prompt_context, 'Ann', '')
+    reroll = prepare_messages(generator, prompt_context, 'Ann', '')
+    other_instruction = prepare_messages(generator, prompt_context, 'Ann', 'Make her angry.')
+    assert prefix_bytes(first) == prefix_bytes(reroll)
+    assert prefix_bytes(first) == prefix_bytes(other_instruction)
+    assert first[2] != other_instruction[2]
+
+
+def test_prefix_does_not_depend_on_character_order(tmp_path):
+    generator = make_generator(tmp_path)
+    reversed_export = dict(EXPORT, Characters=list(reversed(EXPORT['Characters'])))
+    messages = prepare_messages(generator, PromptContext.from_export(EXPORT), 'Ann', '')
+    reversed_messages = prepare_messages(generator, PromptContext.from_export(reversed_export), 'Ann', '')
+    assert prefix_bytes(messages) == prefix_bytes(reversed_messages)